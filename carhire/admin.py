@@ -17,6 +17,7 @@ class VehicleAdmin(admin.ModelAdmin):
     list_display = ('make', 'model', 'year', 'owner', 'daily_rate', 'condition', 'is_approved', 'is_available')
     list_filter = ('make', 'condition', 'is_approved', 'is_available', 'category')
     search_fields = ('make', 'model', 'owner__username')
+    filter_horizontal = ('locations',)
     actions = ['approve_vehicles', 'disapprove_vehicles']
 
     def approve_vehicles(self, request, queryset):
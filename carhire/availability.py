@@ -0,0 +1,55 @@
+"""Availability calendars for many vehicles at once.
+
+Everything here is computed from one booking query for the whole set of
+vehicles, grouped in memory, instead of one query per vehicle and range.
+"""
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+
+from .models import Booking
+
+DAY = timedelta(days=1)
+
+
+def window_bounds(start_day, days):
+    """Aware datetimes spanning ``days`` whole days from ``start_day``"""
+    start = timezone.make_aware(datetime.combine(start_day, time.min))
+    return start, start + days * DAY
+
+
+def booked_intervals(vehicle_ids, start, end):
+    """Occupying booking intervals per vehicle, clipped to the window"""
+    intervals = {vehicle_id: [] for vehicle_id in vehicle_ids}
+    bookings = (
+        Booking.objects.occupying()
+        .overlapping(start, end)
+        .filter(vehicle_id__in=intervals)
+        .order_by('vehicle_id', 'start_date')
+        .values_list('vehicle_id', 'start_date', 'end_date')
+    )
+    for vehicle_id, start_date, end_date in bookings:
+        intervals[vehicle_id].append((max(start_date, start), min(end_date, end)))
+    return intervals
+
+
+def booked_days(intervals, start, days):
+    """A string with one character per day: '1' if any booking touches it"""
+    bitmap = bytearray(b'0' * days)
+    for start_date, end_date in intervals:
+        first = int((start_date - start) // DAY)
+        last = min(-int(-(end_date - start) // DAY), days)
+        bitmap[first:last] = b'1' * (last - first)
+    return bitmap.decode()
+
+
+def calendar(vehicle_ids, start_day, days):
+    """Booked intervals and a per-day bitmap for each vehicle"""
+    start, end = window_bounds(start_day, days)
+    return {
+        vehicle_id: {
+            'booked': [[s.isoformat(), e.isoformat()] for s, e in intervals],
+            'booked_days': booked_days(intervals, start, days),
+        }
+        for vehicle_id, intervals in booked_intervals(vehicle_ids, start, end).items()
+    }
@@ -0,0 +1,108 @@
+"""Helpers shared by the benchmark management commands.
+
+Benchmarks seed synthetic data inside a transaction that is always rolled
+back, so they can be pointed at a development database without leaving
+rows behind.
+"""
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import User, Vehicle, Booking, Location
+
+
+class Rollback(Exception):
+    """Raised to unwind the benchmark transaction"""
+
+
+@contextmanager
+def rolled_back():
+    """Run the block in a transaction that is discarded afterwards"""
+    try:
+        with transaction.atomic():
+            yield
+            raise Rollback()
+    except Rollback:
+        pass
+
+
+@contextmanager
+def measure():
+    """Collect the wall time and query count of the block"""
+    result = {'queries': 0}
+
+    def count(execute, sql, params, many, context):
+        result['queries'] += 1
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(count):
+        started = time.perf_counter()
+        yield result
+        result['ms'] = (time.perf_counter() - started) * 1000
+
+
+def seed_fleet(n_vehicles, bookings_per_vehicle=2, horizon_days=90, seed=0):
+    """Create an owner, a client, ten locations and a booked fleet spread over them"""
+    rng = random.Random(seed)
+    owner = User.objects.create(username=f'bench-owner-{seed}', user_type='owner')
+    client = User.objects.create(username=f'bench-client-{seed}', user_type='client')
+    cities = ['Nairobi', 'Mombasa', 'Kisumu', 'Nakuru', 'Eldoret']
+    Location.objects.bulk_create([
+        Location(name=f'Bench {city} {branch}', city=city) for city in cities for branch in ('Airport', 'CBD')
+    ])
+    location_ids = [location.id for location in Location.objects.filter(name__startswith='Bench ')]
+
+    categories = [choice for choice, _ in Vehicle.CATEGORY_CHOICES]
+    conditions = [choice for choice, _ in Vehicle.CONDITION_CHOICES]
+    Vehicle.objects.bulk_create([
+        Vehicle(
+            owner=owner,
+            make=rng.choice(['Toyota', 'Subaru', 'Audi', 'Nissan', 'Mazda']),
+            model=f'Model {i}',
+            year=rng.randint(2005, 2025),
+            category=rng.choice(categories),
+            condition=rng.choice(conditions),
+            mileage=rng.randint(0, 200000),
+            daily_rate=Decimal(rng.randint(20, 150) * 100),
+            is_approved=True,
+            approval_status='approved',
+        )
+        for i in range(n_vehicles)
+    ], batch_size=1000)
+
+    now = timezone.now()
+    vehicle_ids = list(Vehicle.objects.filter(owner=owner).values_list('id', flat=True))
+    vehicle_locations = {vehicle_id: rng.choice(location_ids) for vehicle_id in vehicle_ids}
+    Vehicle.locations.through.objects.bulk_create([
+        Vehicle.locations.through(vehicle_id=vehicle_id, location_id=location_id)
+        for vehicle_id, location_id in vehicle_locations.items()
+    ], batch_size=1000)
+    statuses = ['confirmed', 'active', 'completed', 'cancelled', 'pending']
+    bookings = []
+    for vehicle_id in vehicle_ids:
+        for _ in range(bookings_per_vehicle):
+            start = now + timedelta(hours=rng.randint(-24 * 30, 24 * horizon_days))
+            days = rng.randint(1, 10)
+            bookings.append(Booking(
+                client=client,
+                vehicle_id=vehicle_id,
+                pickup_location_id=vehicle_locations[vehicle_id],
+                dropoff_location_id=rng.choice(location_ids),
+                start_date=start,
+                end_date=start + timedelta(days=days),
+                drive_type='self',
+                total_days=days,
+                vehicle_cost=Decimal('1000.00') * days,
+                total_cost=Decimal('1000.00') * days,
+                status=rng.choice(statuses),
+            ))
+            if len(bookings) >= 5000:
+                Booking.objects.bulk_create(bookings)
+                bookings = []
+    Booking.objects.bulk_create(bookings)
+    return owner
@@ -0,0 +1,12 @@
+"""Which caches can coordinate worker processes."""
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+
+def is_shared(cache):
+    """False for backends that keep values per process, or not at all
+
+    A version or generation bumped in one worker through such a cache never
+    reaches the others, so it cannot be used to invalidate their state.
+    """
+    return not isinstance(cache, (LocMemCache, DummyCache))
@@ -3,6 +3,7 @@ from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import authenticate
 from .models import User, Vehicle, Payment, Booking, DrivingLicense, Location
 from datetime import datetime, timedelta
+from django.utils import timezone
 from django.core.exceptions import ValidationError
 
 class UserRegistrationForm(UserCreationForm):
@@ -23,7 +24,8 @@ class UserRegistrationForm(UserCreationForm):
 class VehicleForm(forms.ModelForm):
     class Meta:
         model = Vehicle
-        fields = ['make', 'model', 'year', 'category', 'condition', 'mileage', 'daily_rate', 'photo', 'description']
+        fields = ['make', 'model', 'year', 'category', 'condition', 'mileage', 'daily_rate', 'photo', 'description',
+                  'locations']
         widgets = {
             'make': forms.TextInput(attrs={'class': 'form-control'}),
             'model': forms.TextInput(attrs={'class': 'form-control'}),
@@ -34,8 +36,13 @@ class VehicleForm(forms.ModelForm):
             'daily_rate': forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'}),
             'photo': forms.FileInput(attrs={'class': 'form-control'}),
             'description': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
+            'locations': forms.SelectMultiple(attrs={'class': 'form-control'}),
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['locations'].queryset = Location.objects.filter(is_active=True)
+
 class VehicleApprovalForm(forms.Form):
     ACTION_CHOICES = (
         ('approve', 'Approve'),
@@ -83,6 +90,14 @@ class LicenseVerificationForm(forms.Form):
         return cleaned_data
 
 class VehicleSearchForm(forms.Form):
+    SORT_CHOICES = (
+        ('relevance', 'Best match'),
+        ('newest', 'Newest listings'),
+        ('price_asc', 'Price: low to high'),
+        ('price_desc', 'Price: high to low'),
+        ('year_desc', 'Model year: newest first'),
+    )
+
     pickup_location = forms.ModelChoiceField(
         queryset=Location.objects.filter(is_active=True),
         empty_label="Select pickup location",
@@ -99,11 +114,41 @@ class VehicleSearchForm(forms.Form):
     dropoff_date = forms.DateTimeField(
         widget=forms.DateTimeInput(attrs={'class': 'form-control', 'type': 'datetime-local'})
     )
+    q = forms.CharField(
+        required=False, max_length=100, label="Keywords",
+        widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Make, model or features'})
+    )
     category = forms.ChoiceField(
         choices=[('', 'Any Category')] + list(Vehicle.CATEGORY_CHOICES),
         required=False,
         widget=forms.Select(attrs={'class': 'form-control'})
     )
+    min_price = forms.DecimalField(
+        required=False, min_value=0, decimal_places=2,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'placeholder': 'Min KES/day'})
+    )
+    max_price = forms.DecimalField(
+        required=False, min_value=0, decimal_places=2,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'placeholder': 'Max KES/day'})
+    )
+    min_year = forms.IntegerField(
+        required=False,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'placeholder': 'From year'})
+    )
+    max_year = forms.IntegerField(
+        required=False,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'placeholder': 'To year'})
+    )
+    condition = forms.ChoiceField(
+        choices=[('', 'Any Condition')] + list(Vehicle.CONDITION_CHOICES),
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+    sort = forms.ChoiceField(
+        choices=SORT_CHOICES,
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
 
     def clean(self):
         cleaned_data = super().clean()
@@ -113,11 +158,49 @@ class VehicleSearchForm(forms.Form):
         if pickup_date and dropoff_date:
             if pickup_date >= dropoff_date:
                 raise forms.ValidationError("Dropoff date must be after pickup date.")
-            if pickup_date < datetime.now():
+            if pickup_date < timezone.now():
                 raise forms.ValidationError("Pickup date cannot be in the past.")
 
+        min_price, max_price = cleaned_data.get('min_price'), cleaned_data.get('max_price')
+        if min_price is not None and max_price is not None and min_price > max_price:
+            raise forms.ValidationError("Minimum price cannot be above the maximum price.")
+        min_year, max_year = cleaned_data.get('min_year'), cleaned_data.get('max_year')
+        if min_year is not None and max_year is not None and min_year > max_year:
+            raise forms.ValidationError("The year range is reversed.")
+
+        # Keyword searches rank by relevance unless another order was picked
+        query = cleaned_data.get('q', '').strip()
+        cleaned_data['q'] = query
+        sort = cleaned_data.get('sort') or ('relevance' if query else 'newest')
+        cleaned_data['sort'] = 'newest' if sort == 'relevance' and not query else sort
         return cleaned_data
 
+def clean_vehicle_ids(value, limit):
+    """Parse a comma-separated list of vehicle ids"""
+    try:
+        vehicle_ids = {int(part) for part in value.split(',') if part.strip()}
+    except ValueError:
+        raise ValidationError("Vehicle ids must be integers.")
+    if not vehicle_ids:
+        raise ValidationError("Provide at least one vehicle id.")
+    if len(vehicle_ids) > limit:
+        raise ValidationError(f"At most {limit} vehicles can be requested at once.")
+    return vehicle_ids
+
+class AvailabilityCalendarForm(forms.Form):
+    MAX_VEHICLES = 100
+    MAX_DAYS = 366
+
+    vehicles = forms.CharField(help_text="Comma-separated vehicle ids")
+    start = forms.DateField()
+    days = forms.IntegerField(min_value=1, max_value=MAX_DAYS, required=False)
+
+    def clean_vehicles(self):
+        return clean_vehicle_ids(self.cleaned_data['vehicles'], self.MAX_VEHICLES)
+
+    def clean_days(self):
+        return self.cleaned_data.get('days') or 30
+
 class BookingForm(forms.ModelForm):
     class Meta:
         model = Booking
@@ -130,6 +213,26 @@ class BookingForm(forms.ModelForm):
             'drive_type': forms.Select(attrs={'class': 'form-control'}),
         }
 
+class BulkBookingForm(BookingForm):
+    MAX_VEHICLES = 50
+
+    vehicles = forms.CharField(help_text="Comma-separated vehicle ids")
+
+    def clean_vehicles(self):
+        return clean_vehicle_ids(self.cleaned_data['vehicles'], self.MAX_VEHICLES)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start_date = cleaned_data.get('start_date')
+        end_date = cleaned_data.get('end_date')
+
+        if start_date and end_date:
+            if start_date >= end_date:
+                raise forms.ValidationError("End date must be after start date.")
+            if start_date < timezone.now():
+                raise forms.ValidationError("Start date cannot be in the past.")
+        return cleaned_data
+
 class DrivingLicenseForm(forms.ModelForm):
     class Meta:
         model = DrivingLicense
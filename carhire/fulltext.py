@@ -0,0 +1,105 @@
+"""Ranked full-text search over vehicle make, model and description.
+
+SQLite uses the ``carhire_vehicle_fts`` FTS5 table and PostgreSQL a GIN
+index on a ``to_tsvector`` expression, both created by migration 0007. The
+FTS5 table is kept in sync by triggers on ``carhire_vehicle`` and the GIN
+index by PostgreSQL itself, so every vehicle write, including
+``queryset.update()``, is reflected immediately. Other backends fall back to
+unindexed ``icontains`` matching.
+
+SQLite rebuilds a table to alter one of its columns, which silently drops its
+triggers, so ``ensure_sync()`` recreates any missing trigger and reindexes
+after every ``migrate``.
+
+Matching vehicles are annotated with ``rank`` where higher is better.
+"""
+import re
+
+from django.db import connections
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'carhire_vehicle_fts'
+
+# The sync triggers of migration 0007, by name
+SQLITE_TRIGGERS = {
+    'carhire_vehicle_fts_ai': """CREATE TRIGGER IF NOT EXISTS carhire_vehicle_fts_ai
+        AFTER INSERT ON carhire_vehicle BEGIN
+        INSERT INTO carhire_vehicle_fts(rowid, make, model, description)
+        VALUES (new.id, new.make, new.model, new.description);
+    END""",
+    'carhire_vehicle_fts_ad': """CREATE TRIGGER IF NOT EXISTS carhire_vehicle_fts_ad
+        AFTER DELETE ON carhire_vehicle BEGIN
+        INSERT INTO carhire_vehicle_fts(carhire_vehicle_fts, rowid, make, model, description)
+        VALUES ('delete', old.id, old.make, old.model, old.description);
+    END""",
+    'carhire_vehicle_fts_au': """CREATE TRIGGER IF NOT EXISTS carhire_vehicle_fts_au
+        AFTER UPDATE OF make, model, description ON carhire_vehicle BEGIN
+        INSERT INTO carhire_vehicle_fts(carhire_vehicle_fts, rowid, make, model, description)
+        VALUES ('delete', old.id, old.make, old.model, old.description);
+        INSERT INTO carhire_vehicle_fts(rowid, make, model, description)
+        VALUES (new.id, new.make, new.model, new.description);
+    END""",
+}
+
+# Must match the indexed expression in migration 0007 exactly
+PG_DOCUMENT = (
+    "to_tsvector('english', coalesce(\"carhire_vehicle\".\"make\", '') || ' ' || "
+    "coalesce(\"carhire_vehicle\".\"model\", '') || ' ' || coalesce(\"carhire_vehicle\".\"description\", ''))"
+)
+
+
+def ensure_sync(using='default'):
+    """Recreate missing SQLite sync triggers and reindex; returns the names of the triggers recreated"""
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT type, name FROM sqlite_master WHERE name = %s OR name IN (%s, %s, %s)",
+                       [FTS_TABLE, *SQLITE_TRIGGERS])
+        existing = {name for _, name in cursor.fetchall()}
+        if FTS_TABLE not in existing:
+            # Migration 0007 is not applied
+            return []
+        missing = [name for name in SQLITE_TRIGGERS if name not in existing]
+        for name in missing:
+            cursor.execute(SQLITE_TRIGGERS[name])
+        if missing:
+            # Writes made while the triggers were gone never reached the index
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    return missing
+
+
+def terms(text):
+    """Words of the query; punctuation never reaches the match syntax"""
+    return re.findall(r'\w+', text or '')[:10]
+
+
+def match(queryset, text):
+    """Vehicles matching every word of ``text`` as a prefix, annotated with ``rank``"""
+    words = terms(text)
+    if not words:
+        return queryset.annotate(rank=Value(0.0, output_field=FloatField()))
+
+    vendor = connections[queryset.db].vendor
+    if vendor == 'sqlite':
+        expression = ' '.join(f'"{word}"*' for word in words)
+        matching = RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', (expression,))
+        # bm25() is lower for better matches; make, model and description are weighted 10:5:1
+        rank = RawSQL(
+            f'SELECT -bm25({FTS_TABLE}, 10.0, 5.0, 1.0) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s AND rowid = "carhire_vehicle"."id"',
+            (expression,), output_field=FloatField(),
+        )
+        return queryset.filter(id__in=matching).annotate(rank=rank)
+
+    if vendor == 'postgresql':
+        query = ' & '.join(f'{word}:*' for word in words)
+        matches = RawSQL(f"{PG_DOCUMENT} @@ to_tsquery('english', %s)", (query,), output_field=BooleanField())
+        rank = RawSQL(f"ts_rank({PG_DOCUMENT}, to_tsquery('english', %s))", (query,), output_field=FloatField())
+        return queryset.filter(matches).annotate(rank=rank)
+
+    condition = Q()
+    for word in words:
+        condition &= Q(make__icontains=word) | Q(model__icontains=word) | Q(description__icontains=word)
+    return queryset.filter(condition).annotate(rank=Value(0.0, output_field=FloatField()))
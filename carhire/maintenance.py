@@ -0,0 +1,168 @@
+"""Periodic booking and availability maintenance, as set-based queries.
+
+Each step is a single UPDATE, no matter how large the fleet, and sends no
+model signals, so the search cache and occupancy index are invalidated here.
+
+A vehicle's availability can only change on its own when one of its bookings
+starts or ends, so after the first run only bookings with a boundary in
+(last run, now] and their vehicles are considered. The last run is kept in
+the ``availability`` Watermark; without it the whole fleet is rebuilt.
+
+The nightly jobs can also run sharded: ``run_sharded()`` splits each table
+into primary-key ranges and hands them to a pool of worker processes, each
+with its own connection and one transaction per batch. All shards use the
+same ``now``, so the outcome is the same as running the ranges one by one.
+"""
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+
+from . import occupancy, search
+from .models import Booking, DrivingLicense, Vehicle, Watermark
+
+WATERMARK = 'availability'
+
+
+def overdue_bookings(now, since=None):
+    """Active bookings whose period ended by ``now`` (and after ``since``)"""
+    bookings = Booking.objects.filter(status='active', end_date__lte=now)
+    if since is not None:
+        bookings = bookings.filter(end_date__gt=since)
+    return bookings
+
+
+def changed_vehicles(now, since=None):
+    """Vehicles with a booking that started or ended in (since, now]; every vehicle without ``since``"""
+    if since is None:
+        return Vehicle.objects.all()
+    boundaries = Booking.objects.filter(
+        Q(start_date__gt=since, start_date__lte=now) | Q(end_date__gt=since, end_date__lte=now)
+    )
+    return Vehicle.objects.filter(pk__in=boundaries.values('vehicle_id'))
+
+
+def last_run():
+    mark = Watermark.objects.filter(name=WATERMARK).first()
+    return mark.value if mark else None
+
+
+def advance(now):
+    """Record ``now`` as the last run, creating the watermark on the first one"""
+    if Watermark.objects.filter(name=WATERMARK).update(value=now, updated_at=timezone.now()):
+        return
+    try:
+        with transaction.atomic():
+            Watermark.objects.create(name=WATERMARK, value=now)
+    except IntegrityError:
+        # A concurrent first run created it in the meantime
+        Watermark.objects.filter(name=WATERMARK).update(value=now, updated_at=timezone.now())
+
+
+def run(now, full=False):
+    """Complete overdue bookings and refresh availability since the last run
+
+    Returns (completed, refreshed, since), where ``since`` is None after a full rebuild.
+    """
+    with transaction.atomic():
+        # Serializes overlapping runs where row locks exist
+        mark = Watermark.objects.select_for_update().filter(name=WATERMARK).first()
+        since = None if full or mark is None or mark.value >= now else mark.value
+
+        completed = overdue_bookings(now, since).update(status='completed', updated_at=now)
+        refreshed = changed_vehicles(now, since).refresh_availability(now)
+        advance(now)
+
+    if completed:
+        occupancy.invalidate()
+    if refreshed:
+        search.invalidate()
+    return completed, refreshed, since
+
+
+def _complete_bookings(lo, hi, now):
+    return overdue_bookings(now).filter(pk__gte=lo, pk__lt=hi).update(status='completed', updated_at=now)
+
+
+def _refresh_availability(lo, hi, now):
+    return Vehicle.objects.filter(pk__gte=lo, pk__lt=hi).refresh_availability(now)
+
+
+def _expire_licenses(lo, hi, now):
+    return DrivingLicense.objects.filter(
+        pk__gte=lo, pk__lt=hi, verification_status='verified', expiry_date__lt=now.date()
+    ).update(verification_status='expired', is_verified=False)
+
+
+# Run in this order: availability is refreshed after bookings are completed
+JOBS = {
+    'complete_bookings': (Booking, _complete_bookings),
+    'refresh_availability': (Vehicle, _refresh_availability),
+    'expire_licenses': (DrivingLicense, _expire_licenses),
+}
+
+
+def pk_ranges(model, shards):
+    """Split the table's primary keys into at most ``shards`` half-open ranges"""
+    bounds = model.objects.aggregate(lo=Min('pk'), hi=Max('pk'))
+    if bounds['lo'] is None:
+        return []
+    lo, hi = bounds['lo'], bounds['hi'] + 1
+    step = -(-(hi - lo) // shards)
+    return [(start, min(start + step, hi)) for start in range(lo, hi, step)]
+
+
+def run_shard(job, lo, hi, now, batch_size=1000):
+    """Run one job over the primary keys [lo, hi), committing every batch"""
+    _, apply = JOBS[job]
+    started = time.perf_counter()
+    rows = batches = 0
+    for start in range(lo, hi, batch_size):
+        with transaction.atomic():
+            rows += apply(start, min(start + batch_size, hi), now)
+        batches += 1
+    return {'job': job, 'lo': lo, 'hi': hi, 'rows': rows, 'batches': batches,
+            'ms': (time.perf_counter() - started) * 1000}
+
+
+def _init_worker():
+    django.setup()
+    # Never reuse a connection inherited from the parent process
+    connections.close_all()
+
+
+def run_sharded(now, jobs=tuple(JOBS), workers=4, shards=None, batch_size=1000, progress=None):
+    """Run the maintenance jobs shard by shard; with one worker everything runs in this process
+
+    ``progress`` is called with each shard's result as it finishes.
+    """
+    shards = shards or workers
+    # JOBS order, whatever order the caller named them in
+    jobs = [job for job in JOBS if job in jobs]
+    results = []
+
+    def finished(result):
+        results.append(result)
+        if progress:
+            progress(result)
+
+    if workers == 1:
+        for job in jobs:
+            for lo, hi in pk_ranges(JOBS[job][0], shards):
+                finished(run_shard(job, lo, hi, now, batch_size))
+    else:
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            for job in jobs:
+                futures = [pool.submit(run_shard, job, lo, hi, now, batch_size)
+                           for lo, hi in pk_ranges(JOBS[job][0], shards)]
+                # Jobs stay sequential; only the shards of one job run side by side
+                for future in as_completed(futures):
+                    finished(future.result())
+
+    occupancy.invalidate()
+    search.invalidate()
+    return results
@@ -0,0 +1,90 @@
+import random
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from carhire.benchmarking import rolled_back, measure, seed_fleet
+from carhire.models import Booking, Location, User, Vehicle
+
+MODES = ('materialized', 'computed')
+
+
+class Command(BaseCommand):
+    help = "Compare the materialized is_available column with computing availability at query time"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vehicles', type=int, default=10000)
+        parser.add_argument('--bookings-per-vehicle', type=int, default=100)
+        parser.add_argument('--reads', type=int, default=20, help="Repetitions of each read")
+        parser.add_argument('--writes', type=int, default=200, help="Booking saves per mode")
+        parser.add_argument('--free-share', type=float, default=0.3,
+                            help="Fraction of the fleet whose future bookings are cancelled so it is listed")
+
+    def handle(self, *args, **options):
+        with rolled_back():
+            self.stdout.write(f"Seeding {options['vehicles']} vehicles with "
+                              f"{options['vehicles'] * options['bookings_per_vehicle']} bookings...")
+            owner = seed_fleet(options['vehicles'], options['bookings_per_vehicle'], horizon_days=365)
+            self.free_up(owner, options['free_share'])
+            Vehicle.objects.filter(owner=owner).refresh_availability()
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+            self.stdout.write(f"{'mode':>13} {'operation':>12} {'queries/op':>11} {'ms/op':>9} {'rows':>7}")
+            counts = {}
+            for mode in MODES:
+                with override_settings(AVAILABILITY_MODE=mode):
+                    for name, run in self.reads(owner):
+                        with measure() as result:
+                            for _ in range(options['reads']):
+                                rows = run()
+                        self.write_row(mode, name, result, options['reads'], rows)
+                        if name == 'count':
+                            counts[mode] = rows
+                    with rolled_back():
+                        result, saved = self.write(owner, options['writes'])
+                        self.write_row(mode, 'booking save', result, saved, saved)
+
+            if counts['materialized'] != counts['computed']:
+                self.stdout.write(self.style.WARNING(
+                    f"Modes disagree: {counts['materialized']} listed vs {counts['computed']} computed"
+                ))
+
+    def free_up(self, owner, share):
+        """With many bookings per car nearly every vehicle has a future one; release some of the fleet"""
+        vehicle_ids = list(Vehicle.objects.filter(owner=owner).values_list('id', flat=True))
+        freed = vehicle_ids[:int(len(vehicle_ids) * share)]
+        Booking.objects.filter(vehicle_id__in=freed, end_date__gt=timezone.now()).update(status='cancelled')
+
+    def reads(self, owner):
+        fleet = Vehicle.objects.filter(owner=owner)
+        return (
+            ('home', lambda: len(fleet.listed()[:6])),
+            ('first page', lambda: len(fleet.listed().order_by('-created_at', '-id')[:9])),
+            ('count', lambda: fleet.listed().count()),
+        )
+
+    def write(self, owner, count):
+        """Save new confirmed bookings one at a time, as book_vehicle and payment do"""
+        rng = random.Random(1)
+        vehicles = list(Vehicle.objects.filter(owner=owner).only('id', 'daily_rate', 'category')[:count])
+        client = User.objects.get(username='bench-client-0')
+        location = Location.objects.filter(name__startswith='Bench ').first()
+        now = timezone.now()
+        with measure() as result:
+            for vehicle in vehicles:
+                start = now + timedelta(days=rng.randint(400, 800))
+                Booking(client=client, vehicle=vehicle, pickup_location=location, dropoff_location=location,
+                        start_date=start, end_date=start + timedelta(days=3), drive_type='self',
+                        status='confirmed').save()
+        return result, len(vehicles)
+
+    def write_row(self, mode, name, result, repetitions, rows):
+        repetitions = max(repetitions, 1)
+        self.stdout.write(
+            f"{mode:>13} {name:>12} {result['queries'] / repetitions:>11.1f} "
+            f"{result['ms'] / repetitions:>9.2f} {rows:>7}"
+        )
@@ -0,0 +1,36 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from carhire.benchmarking import rolled_back, measure, seed_fleet
+from carhire.models import Vehicle
+
+
+class Command(BaseCommand):
+    help = "Compare the per-vehicle availability loop with the set-based search query"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+        parser.add_argument('--bookings-per-vehicle', type=int, default=2)
+
+    def handle(self, *args, **options):
+        start = timezone.now() + timedelta(days=7)
+        end = start + timedelta(days=3)
+
+        self.stdout.write(f"{'vehicles':>9} {'strategy':>12} {'queries':>8} {'ms':>10} {'results':>8}")
+        for size in options['sizes']:
+            with rolled_back():
+                owner = seed_fleet(size, options['bookings_per_vehicle'])
+                fleet = Vehicle.objects.filter(owner=owner, is_available=True)
+
+                with measure() as loop:
+                    ids = [v.id for v in fleet.approved() if v.is_available_for_dates(start, end)]
+                with measure() as query:
+                    found = list(fleet.available_between(start, end).values_list('id', flat=True))
+
+                assert sorted(ids) == sorted(found)
+                for name, result in (('loop', loop), ('set-based', query)):
+                    self.stdout.write(
+                        f"{size:>9} {name:>12} {result['queries']:>8} {result['ms']:>10.1f} {len(found):>8}"
+                    )
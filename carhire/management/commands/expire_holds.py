@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from carhire.reservations import expire_holds
+
+
+class Command(BaseCommand):
+    help = "Cancel held bookings whose payment window has passed"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=0,
+                            help="Keep sweeping every N seconds instead of running once")
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            expired = expire_holds()
+            ms = (time.perf_counter() - started) * 1000
+            self.stdout.write(f"Expired {expired} hold{'s' if expired != 1 else ''} in {ms:.1f} ms")
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,118 @@
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+
+from carhire import search
+from carhire.benchmarking import rolled_back, seed_fleet
+from carhire.models import Vehicle, Booking, Payment
+
+# Indexes and constraints dropped to produce the "before" plans
+INDEXED_MODELS = (Vehicle, Booking, Payment)
+FIELD_INDEXES = ((Booking, 'booking_id'), (Payment, 'paystack_reference'))
+
+
+def hot_queries(sample):
+    """The queries whose plans the indexes are meant to improve"""
+    return {
+        'search': Vehicle.objects.filter(is_available=True, category='suv').at_location(
+            sample['location_id']).available_between(sample['start'], sample['end']),
+        'home': Vehicle.objects.filter(is_approved=True, approval_status='approved', is_available=True)[:6],
+        'overlap check': Booking.objects.occupying().overlapping(sample['start'], sample['end']).filter(
+            vehicle_id=sample['vehicle_id']),
+        'search by price': search.available_vehicles(
+            sample['start'], sample['end'], sample['location_id'], sort='price_asc')[:10],
+        'fleet by price': search.available_vehicles(sample['start'], sample['end'], sort='price_asc')[:10],
+        'search by price range': search.available_vehicles(
+            sample['start'], sample['end'], sample['location_id'], category='suv',
+            min_price=3000, max_price=6000, sort='price_desc')[:10],
+        'search by year': search.available_vehicles(
+            sample['start'], sample['end'], sample['location_id'], min_year=2018, sort='year_desc')[:10],
+        'keyword search': search.available_vehicles(sample['start'], sample['end'], q='toyota')[:10],
+        'booking by uuid': Booking.objects.filter(booking_id=sample['booking_id']),
+        'payment by reference': Payment.objects.by_reference(sample['reference']),
+        'all bookings page': Booking.objects.order_by('-created_at', '-id')[:11],
+        'client bookings page': Booking.objects.filter(client_id=sample['client_id']).order_by(
+            '-created_at', '-id')[:11],
+    }
+
+
+class Command(BaseCommand):
+    help = "Print query plans for the hot paths with and without the composite indexes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vehicles', type=int, default=2000)
+        parser.add_argument('--bookings-per-vehicle', type=int, default=5)
+
+    def handle(self, *args, **options):
+        with rolled_back():
+            sample = self.seed(options['vehicles'], options['bookings_per_vehicle'])
+            after = self.explain(sample)
+            self.drop_indexes()
+            before = self.explain(sample)
+
+        for name in after:
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write("  before:")
+            self.write_plan(before[name])
+            self.stdout.write("  after:")
+            self.write_plan(after[name])
+
+    def seed(self, vehicles, bookings_per_vehicle):
+        owner = seed_fleet(vehicles, bookings_per_vehicle)
+        bookings = list(Booking.objects.filter(vehicle__owner=owner).only('id', 'total_cost')[:vehicles])
+        Payment.objects.bulk_create([
+            Payment(booking=booking, amount=booking.total_cost, phone_number='0700000000',
+                    paystack_reference=f"MOTR_{uuid.uuid4().hex[:12]}", status='processing',
+                    processing_at=timezone.now())
+            for booking in bookings
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+        start = timezone.now() + timedelta(days=7)
+        payment = Payment.objects.order_by('?').first()
+        return {
+            'start': start,
+            'end': start + timedelta(days=3),
+            'vehicle_id': bookings[0].vehicle_id if bookings else 0,
+            'location_id': bookings[0].pickup_location_id if bookings else 0,
+            'booking_id': payment.booking.booking_id,
+            'client_id': payment.booking.client_id,
+            'reference': payment.paystack_reference,
+        }
+
+    def explain(self, sample):
+        return {name: queryset.explain() for name, queryset in hot_queries(sample).items()}
+
+    def drop_indexes(self):
+        with connection.cursor() as cursor:
+            targets = []
+            for model in INDEXED_MODELS:
+                table = model._meta.db_table
+                targets += [(table, index.name) for index in model._meta.indexes]
+                targets += [(table, constraint.name) for constraint in model._meta.constraints]
+            for model, column in FIELD_INDEXES:
+                table = model._meta.db_table
+                constraints = connection.introspection.get_constraints(cursor, table)
+                targets += [(table, name) for name, info in constraints.items()
+                            if (info['index'] or info['unique']) and info['columns'] == [column]
+                            and (table, name) not in targets]
+
+            for table, name in targets:
+                try:
+                    with transaction.atomic():
+                        cursor.execute(f'DROP INDEX {connection.ops.quote_name(name)}')
+                except DatabaseError:
+                    if connection.vendor != 'postgresql':
+                        self.stderr.write(f"Keeping {name}: it is part of the {table} table definition")
+                        continue
+                    # PostgreSQL backs unique fields with a table constraint
+                    cursor.execute(f'ALTER TABLE {connection.ops.quote_name(table)} '
+                                   f'DROP CONSTRAINT {connection.ops.quote_name(name)}')
+
+    def write_plan(self, plan):
+        for line in plan.splitlines():
+            self.stdout.write(f"    {line}")
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from carhire import metrics
+
+
+class Command(BaseCommand):
+    help = "Print the application metrics recorded in the metrics cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help="Clear every metric after printing")
+
+    def handle(self, *args, **options):
+        values = metrics.snapshot()
+        if not values:
+            self.stdout.write("No metrics recorded")
+        width = max((len(name) for name in values), default=0)
+        for name, value in values.items():
+            self.stdout.write(f"{name:<{width}}  {value}")
+        if options['reset']:
+            metrics.reset()
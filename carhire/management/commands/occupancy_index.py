@@ -0,0 +1,61 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from carhire import occupancy
+
+
+class Command(BaseCommand):
+    help = "Rebuild the occupancy index or check it against the bookings table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help="Make every process sharing the cache rebuild its index")
+        parser.add_argument('--check', action='store_true',
+                            help="Compare this process's live index with overlap queries")
+        parser.add_argument('--windows', type=int, default=200,
+                            help="Number of random windows to compare (default: 200)")
+        parser.add_argument('--interval', type=int, default=0,
+                            help="With --check, keep the index and check again every N seconds, as a worker "
+                                 "would keep it, until a check fails")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        index = occupancy.get_index()
+        elapsed = (time.perf_counter() - started) * 1000
+        stats = index.stats()
+        self.stdout.write(
+            f"Loaded index in {elapsed:.1f} ms: {stats['vehicles']} vehicles, "
+            f"{stats['bookings']} bookings, {stats['slots']} hourly slots, {stats['bytes']} bytes"
+        )
+
+        if options['rebuild']:
+            occupancy.invalidate()
+            self.stdout.write(self.style.SUCCESS("Index generation bumped"))
+
+        if options['check']:
+            while True:
+                self.check(options['windows'])
+                if not options['interval']:
+                    break
+                time.sleep(options['interval'])
+
+    def check(self, count):
+        # The same long-lived index searches use: rebuilt only on a new generation or once too old
+        index = occupancy.get_index()
+        rng = random.Random()
+        windows = []
+        for _ in range(count):
+            start = index.origin + timedelta(hours=rng.randrange(index.size))
+            end = min(start + timedelta(hours=rng.randint(1, 24 * 14)), index.end)
+            windows.append((start, end))
+
+        mismatches = occupancy.check_consistency(windows, index)
+        for start, end, missing, extra in mismatches:
+            self.stderr.write(f"{start:%Y-%m-%d %H:%M} - {end:%Y-%m-%d %H:%M}: "
+                              f"missing {sorted(missing)} extra {sorted(extra)}")
+        if mismatches:
+            raise CommandError(f"{len(mismatches)} of {len(windows)} windows disagree with the database")
+        self.stdout.write(self.style.SUCCESS(f"{len(windows)} windows match the database"))
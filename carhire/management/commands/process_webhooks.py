@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from carhire import webhooks
+
+
+class Command(BaseCommand):
+    help = "Apply queued payment webhooks in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--interval', type=int, default=0,
+                            help="Keep draining every N seconds instead of running once")
+        parser.add_argument('--stats', action='store_true', help="Only print the inbox depth and lag")
+
+    def handle(self, *args, **options):
+        while True:
+            if not options['stats']:
+                self.drain(options['batch_size'])
+            values = webhooks.stats()
+            self.stdout.write(f"Inbox depth {values['depth']}, lag {values['lag']:.1f} s, "
+                              f"{values['dead']} out of attempts")
+            if options['stats'] or not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def drain(self, batch_size):
+        started = time.perf_counter()
+        total = 0
+        while True:
+            taken = webhooks.process_batch(batch_size)
+            total += taken
+            if taken < batch_size:
+                break
+        seconds = time.perf_counter() - started
+        rate = total / seconds if seconds else 0
+        self.stdout.write(f"Processed {total} event{'s' if total != 1 else ''} in {seconds * 1000:.1f} ms "
+                          f"({rate:.0f}/s)")
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from carhire import webhooks
+
+
+class Command(BaseCommand):
+    help = "Delete processed and dead webhook events older than the retention period"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help="Retention in days (default: WEBHOOK_RETENTION_DAYS)")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        deleted = webhooks.prune(options['days'], options['batch_size'])
+        ms = (time.perf_counter() - started) * 1000
+        self.stdout.write(f"Pruned {deleted} event{'s' if deleted != 1 else ''} in {ms:.1f} ms")
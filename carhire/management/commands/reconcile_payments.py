@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from carhire import reconciliation
+
+
+class Command(BaseCommand):
+    help = "Verify payments stuck in processing with the gateway and settle them"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=30, help="Minutes a payment must have been processing")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Concurrent verify calls (default: PAYSTACK_POOL_SIZE)")
+        parser.add_argument('--batch-size', type=int, default=50, help="Payments applied per transaction")
+        parser.add_argument('--limit', type=int, default=None, help="Check at most this many payments")
+
+    def handle(self, *args, **options):
+        totals = reconciliation.reconcile(
+            timezone.now(), minutes=options['older_than'], workers=options['workers'],
+            batch_size=options['batch_size'], limit=options['limit'], progress=self.write_progress,
+        )
+        rate = totals['checked'] / totals['seconds'] if totals['seconds'] else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {totals['checked']} payment{'s' if totals['checked'] != 1 else ''} "
+            f"in {totals['seconds'] * 1000:.1f} ms ({rate:.0f}/s): {totals['completed']} completed, "
+            f"{totals['failed']} failed, {totals['conflict']} completed without their dates, "
+            f"{totals['skipped']} already settled, {totals['unresolved']} unresolved"
+        ))
+
+    def write_progress(self, done, total):
+        self.stdout.write(f"  {done}/{total}")
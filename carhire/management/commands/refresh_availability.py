@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from carhire import maintenance
+
+
+class Command(BaseCommand):
+    help = "Complete overdue bookings and recompute vehicle availability with set-based updates"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Report what would change without writing")
+        parser.add_argument('--full', action='store_true',
+                            help="Rebuild the whole fleet instead of only vehicles changed since the last run")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        now = timezone.now()
+        if options['dry_run']:
+            since = None if options['full'] else maintenance.last_run()
+            overdue = maintenance.overdue_bookings(now, since).count()
+            stale = maintenance.changed_vehicles(now, since).stale_availability(now).count()
+            self.write_scope(since)
+            self.stdout.write(f"Would complete {overdue} overdue booking{'s' if overdue != 1 else ''}")
+            self.stdout.write(f"Would change availability of {stale} vehicle{'s' if stale != 1 else ''}")
+        else:
+            completed, refreshed, since = maintenance.run(now, full=options['full'])
+            self.write_scope(since)
+            self.stdout.write(f"Completed {completed} overdue booking{'s' if completed != 1 else ''}")
+            self.stdout.write(f"Refreshed availability of {refreshed} vehicle{'s' if refreshed != 1 else ''}")
+        self.stdout.write(f"Finished in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    def write_scope(self, since):
+        if since is None:
+            self.stdout.write("Full rebuild")
+        else:
+            self.stdout.write(f"Incremental since {since:%Y-%m-%d %H:%M:%S}")
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from carhire import maintenance
+
+
+class Command(BaseCommand):
+    help = "Run the nightly maintenance jobs over primary-key shards in parallel worker processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--jobs', nargs='+', choices=list(maintenance.JOBS), default=list(maintenance.JOBS))
+        parser.add_argument('--workers', type=int, default=4, help="Worker processes; 1 runs serially")
+        parser.add_argument('--shards', type=int, default=None, help="Key ranges per table (default: --workers)")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows per transaction")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        results = maintenance.run_sharded(
+            timezone.now(), jobs=options['jobs'], workers=options['workers'], shards=options['shards'],
+            batch_size=options['batch_size'], progress=self.write_shard,
+        )
+        for job in options['jobs']:
+            rows = sum(result['rows'] for result in results if result['job'] == job)
+            self.stdout.write(self.style.SUCCESS(f"{job}: {rows} row{'s' if rows != 1 else ''}"))
+        self.stdout.write(f"Finished in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    def write_shard(self, result):
+        self.stdout.write(
+            f"  {result['job']} [{result['lo']}, {result['hi']}): "
+            f"{result['rows']} row{'s' if result['rows'] != 1 else ''} "
+            f"in {result['batches']} batch{'es' if result['batches'] != 1 else ''}, {result['ms']:.1f} ms"
+        )
@@ -0,0 +1,84 @@
+"""Counters, gauges and timings shared between processes through the cache.
+
+Values live in the cache named by METRICS_CACHE_ALIAS, so a shared backend
+(file, memcached, redis) aggregates every worker while the local-memory
+backend reports the current process only. ``manage.py metrics`` prints them.
+"""
+from django.conf import settings
+from django.core.cache import caches
+
+PREFIX = 'carhire:metrics:'
+NAMES_KEY = PREFIX + 'names'
+
+_known = set()
+
+
+def _cache():
+    return caches[getattr(settings, 'METRICS_CACHE_ALIAS', 'default')]
+
+
+def _register(name):
+    if name in _known:
+        return
+    cache = _cache()
+    names = set(cache.get(NAMES_KEY, ()))
+    if name not in names:
+        names.add(name)
+        cache.set(NAMES_KEY, names, None)
+    _known.add(name)
+
+
+def _incr(key, amount):
+    cache = _cache()
+    try:
+        cache.incr(key, amount)
+    except ValueError:
+        # First write; a concurrent add wins and we increment its value
+        if not cache.add(key, amount, None):
+            cache.incr(key, amount)
+
+
+def incr(name, amount=1):
+    """Add to a counter"""
+    _register(name)
+    _incr(PREFIX + name, amount)
+
+
+def gauge(name, value):
+    """Record the latest value of a measurement"""
+    _register(name)
+    _cache().set(PREFIX + name, value, None)
+
+
+def timing(name, ms):
+    """Record a duration in milliseconds; keeps the count, total and maximum"""
+    _register(name)
+    cache = _cache()
+    _incr(f'{PREFIX}{name}.count', 1)
+    _incr(f'{PREFIX}{name}.total_us', int(ms * 1000))
+    if ms > cache.get(f'{PREFIX}{name}.max_ms', 0):
+        cache.set(f'{PREFIX}{name}.max_ms', ms, None)
+
+
+def snapshot():
+    """Current value of every metric recorded so far"""
+    cache = _cache()
+    values = {}
+    for name in sorted(cache.get(NAMES_KEY, ())):
+        count = cache.get(f'{PREFIX}{name}.count')
+        if count is None:
+            values[name] = cache.get(PREFIX + name)
+            continue
+        total_us = cache.get(f'{PREFIX}{name}.total_us', 0)
+        values[f'{name}.count'] = count
+        values[f'{name}.avg_ms'] = round(total_us / count / 1000, 3) if count else 0
+        values[f'{name}.max_ms'] = round(cache.get(f'{PREFIX}{name}.max_ms', 0), 3)
+    return values
+
+
+def reset():
+    cache = _cache()
+    for name in cache.get(NAMES_KEY, ()):
+        cache.delete_many([PREFIX + name] + [f'{PREFIX}{name}.{part}' for part in ('count', 'total_us', 'max_ms')])
+    cache.delete(NAMES_KEY)
+    _known.clear()
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.16 on 2026-10-17 00:16
+
+from django.db import migrations, models
+import uuid
+
+
+def regenerate_duplicate_booking_ids(apps, schema_editor):
+    """Give rows that share a booking_id a fresh one before it becomes unique"""
+    Booking = apps.get_model('carhire', 'Booking')
+    seen = set()
+    for booking in Booking.objects.order_by('id').only('id', 'booking_id'):
+        if booking.booking_id in seen:
+            booking.booking_id = uuid.uuid4()
+            booking.save(update_fields=['booking_id'])
+        seen.add(booking.booking_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carhire', '0003_alter_booking_booking_id'),
+    ]
+
+    operations = [
+        migrations.RunPython(regenerate_duplicate_booking_ids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='booking',
+            name='booking_id',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['vehicle', 'status', 'start_date', 'end_date'], name='booking_vehicle_overlap_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vehicle',
+            index=models.Index(fields=['is_approved', 'approval_status', 'is_available', 'category'], name='vehicle_search_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='payment',
+            constraint=models.UniqueConstraint(condition=models.Q(('paystack_reference', ''), _negated=True), fields=('paystack_reference',), name='payment_paystack_ref_uniq'),
+        ),
+    ]
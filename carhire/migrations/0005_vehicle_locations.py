@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-17 00:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carhire', '0004_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vehicle',
+            name='locations',
+            field=models.ManyToManyField(blank=True, help_text='Locations where the vehicle can be picked up; leave empty for all', related_name='vehicles', to='carhire.location'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.16 on 2026-10-17 00:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carhire', '0005_vehicle_locations'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='vehicle',
+            index=models.Index(condition=models.Q(('approval_status', 'approved'), ('is_approved', True), ('is_available', True)), fields=['daily_rate', 'id'], name='vehicle_listed_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vehicle',
+            index=models.Index(condition=models.Q(('approval_status', 'approved'), ('is_approved', True), ('is_available', True)), fields=['category', 'daily_rate', 'id'], name='vehicle_listed_cat_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vehicle',
+            index=models.Index(condition=models.Q(('approval_status', 'approved'), ('is_approved', True), ('is_available', True)), fields=['year', 'id'], name='vehicle_listed_year_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vehicle',
+            index=models.Index(condition=models.Q(('approval_status', 'approved'), ('is_approved', True), ('is_available', True)), fields=['created_at', 'id'], name='vehicle_listed_created_idx'),
+        ),
+    ]
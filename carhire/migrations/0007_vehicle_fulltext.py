@@ -0,0 +1,63 @@
+from django.db import migrations
+
+SQLITE_FORWARD = [
+    """CREATE VIRTUAL TABLE carhire_vehicle_fts USING fts5(
+        make, model, description,
+        content='carhire_vehicle', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    """CREATE TRIGGER carhire_vehicle_fts_ai AFTER INSERT ON carhire_vehicle BEGIN
+        INSERT INTO carhire_vehicle_fts(rowid, make, model, description)
+        VALUES (new.id, new.make, new.model, new.description);
+    END""",
+    """CREATE TRIGGER carhire_vehicle_fts_ad AFTER DELETE ON carhire_vehicle BEGIN
+        INSERT INTO carhire_vehicle_fts(carhire_vehicle_fts, rowid, make, model, description)
+        VALUES ('delete', old.id, old.make, old.model, old.description);
+    END""",
+    """CREATE TRIGGER carhire_vehicle_fts_au AFTER UPDATE OF make, model, description ON carhire_vehicle BEGIN
+        INSERT INTO carhire_vehicle_fts(carhire_vehicle_fts, rowid, make, model, description)
+        VALUES ('delete', old.id, old.make, old.model, old.description);
+        INSERT INTO carhire_vehicle_fts(rowid, make, model, description)
+        VALUES (new.id, new.make, new.model, new.description);
+    END""",
+    "INSERT INTO carhire_vehicle_fts(carhire_vehicle_fts) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS carhire_vehicle_fts_au",
+    "DROP TRIGGER IF EXISTS carhire_vehicle_fts_ad",
+    "DROP TRIGGER IF EXISTS carhire_vehicle_fts_ai",
+    "DROP TABLE IF EXISTS carhire_vehicle_fts",
+]
+
+POSTGRESQL_FORWARD = [
+    """CREATE INDEX vehicle_fulltext_idx ON carhire_vehicle USING GIN (
+        to_tsvector('english', coalesce("carhire_vehicle"."make", '') || ' ' ||
+        coalesce("carhire_vehicle"."model", '') || ' ' || coalesce("carhire_vehicle"."description", ''))
+    )""",
+]
+
+POSTGRESQL_BACKWARD = [
+    "DROP INDEX IF EXISTS vehicle_fulltext_idx",
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement, params=None)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carhire', '0006_listed_vehicle_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRESQL_FORWARD}),
+            run({'sqlite': SQLITE_BACKWARD, 'postgresql': POSTGRESQL_BACKWARD}),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-17 00:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carhire', '0009_availability_watermark'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='drivinglicense',
+            name='verification_status',
+            field=models.CharField(choices=[('pending', 'Pending Verification'), ('verified', 'Verified'), ('rejected', 'Rejected'), ('expired', 'Expired')], default='pending', max_length=10),
+        ),
+    ]
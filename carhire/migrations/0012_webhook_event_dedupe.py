@@ -0,0 +1,45 @@
+# Generated by Django 4.2.16 on 2026-10-17 00:52
+
+import json
+
+from django.db import migrations, models
+
+
+def backfill_gateway_ids(apps, schema_editor):
+    """Fill gateway_id from stored payloads and drop earlier duplicates so the constraint can be added"""
+    WebhookEvent = apps.get_model('carhire', 'WebhookEvent')
+    seen = set()
+    duplicates = []
+    for event in WebhookEvent.objects.order_by('id').iterator():
+        event.gateway_id = str((json.loads(event.payload).get('data') or {}).get('id') or '')
+        key = (event.event, event.gateway_id, event.reference)
+        if key in seen and (event.gateway_id or event.reference):
+            duplicates.append(event.pk)
+        else:
+            seen.add(key)
+            event.save(update_fields=['gateway_id'])
+    WebhookEvent.objects.filter(pk__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carhire', '0011_webhook_inbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhookevent',
+            name='gateway_id',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.RunPython(backfill_gateway_ids, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='webhookevent',
+            index=models.Index(fields=['processed_at'], name='webhook_event_processed_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='webhookevent',
+            constraint=models.UniqueConstraint(condition=models.Q(('gateway_id', ''), ('reference', ''), _negated=True), fields=('event', 'gateway_id', 'reference'), name='webhook_event_uniq'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.16 on 2026-10-17 00:56
+
+from django.db import migrations, models
+
+
+def backfill_processing_at(apps, schema_editor):
+    """Date payments already processing from their creation, the closest time on record"""
+    Payment = apps.get_model('carhire', 'Payment')
+    Payment.objects.filter(status='processing').update(processing_at=models.F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carhire', '0012_webhook_event_dedupe'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='processing_at',
+            field=models.DateTimeField(blank=True, help_text='When the payment was last sent to Paystack', null=True),
+        ),
+        migrations.RunPython(backfill_processing_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(condition=models.Q(('status', 'processing')), fields=['processing_at'], name='payment_processing_idx'),
+        ),
+    ]
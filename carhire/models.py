@@ -1,4 +1,6 @@
+from django.conf import settings
 from django.db import models
+from django.db.models import Case, Exists, F, OuterRef, Q, Value, When
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MinValueValidator, MaxValueValidator
 from datetime import datetime, timedelta
@@ -7,6 +9,8 @@ import uuid
 from django.contrib.auth.models import User
 from cloudinary.models import CloudinaryField  # type: ignore # Replace ImageField with this
 
+from . import pricing
+
 class User(AbstractUser):
     USER_TYPES = (
         ('client', 'Client'),
@@ -31,6 +35,60 @@ class Location(models.Model):
     def __str__(self):
         return f"{self.name}, {self.city}"
 
+# Vehicles that can appear in search results
+LISTED = Q(is_approved=True, approval_status='approved', is_available=True)
+
+def availability_mode():
+    """'materialized' reads Vehicle.is_available, 'computed' derives it from bookings per query"""
+    return getattr(settings, 'AVAILABILITY_MODE', 'materialized')
+
+class VehicleQuerySet(models.QuerySet):
+    def approved(self):
+        """Vehicles that passed admin review"""
+        return self.filter(is_approved=True, approval_status='approved')
+
+    def listed(self):
+        """Approved vehicles currently offered for hire"""
+        if availability_mode() == 'computed':
+            return self.approved().filter(self._computed_availability())
+        return self.filter(LISTED)
+
+    def at_location(self, location):
+        """Vehicles that can be picked up at the given location; a vehicle without locations serves them all"""
+        served = Vehicle.locations.through.objects.filter(vehicle=OuterRef('pk'))
+        return self.filter(Exists(served.filter(location=location)) | ~Exists(served))
+
+    def available_between(self, start_date, end_date):
+        """Approved vehicles with no occupying booking overlapping the range"""
+        overlapping = Booking.objects.occupying().overlapping(start_date, end_date).filter(
+            vehicle=OuterRef('pk')
+        )
+        return self.approved().filter(~Exists(overlapping))
+
+    @staticmethod
+    def _computed_availability(now=None):
+        """Vehicle.update_availability() as an expression: no current or future occupying booking
+
+        Holds are left out: they lapse without a write, which would leave the
+        stored flag wrong until the next refresh.
+        """
+        now = now or timezone.now()
+        blocking = Booking.objects.filter(vehicle=OuterRef('pk'), status__in=Booking.OCCUPYING_STATUSES,
+                                          end_date__gt=now)
+        return ~Exists(blocking)
+
+    def with_computed_availability(self, now=None):
+        """Annotate ``computed_available``, what is_available should be right now"""
+        return self.annotate(computed_available=self._computed_availability(now))
+
+    def stale_availability(self, now=None):
+        """Vehicles whose stored is_available disagrees with their bookings"""
+        return self.with_computed_availability(now).exclude(is_available=F('computed_available'))
+
+    def refresh_availability(self, now=None):
+        """Set-based Vehicle.update_availability(): one UPDATE for every vehicle in the queryset"""
+        return self.update(is_available=self._computed_availability(now))
+
 class Vehicle(models.Model):
     CONDITION_CHOICES = (
         ('excellent', 'Excellent'),
@@ -79,8 +137,27 @@ class Vehicle(models.Model):
     reviewed_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='reviewed_vehicles')
     reviewed_at = models.DateTimeField(null=True, blank=True)
     is_available = models.BooleanField(default=True)
+    locations = models.ManyToManyField(Location, related_name='vehicles', blank=True,
+                                       help_text="Locations where the vehicle can be picked up; leave empty for all")
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = VehicleQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['is_approved', 'approval_status', 'is_available', 'category'],
+                         name='vehicle_search_idx'),
+            # Sorted search over listed vehicles, one index per sort order
+            models.Index(fields=['daily_rate', 'id'], condition=LISTED,
+                         name='vehicle_listed_price_idx'),
+            models.Index(fields=['category', 'daily_rate', 'id'], condition=LISTED,
+                         name='vehicle_listed_cat_price_idx'),
+            models.Index(fields=['year', 'id'], condition=LISTED,
+                         name='vehicle_listed_year_idx'),
+            models.Index(fields=['created_at', 'id'], condition=LISTED,
+                         name='vehicle_listed_created_idx'),
+        ]
+
     def __str__(self):
         return f"{self.year} {self.make} {self.model}"
 
@@ -89,18 +166,22 @@ class Vehicle(models.Model):
         if not self.is_approved or self.approval_status != 'approved':
             return False
             
-        overlapping_bookings = self.bookings.filter(
-            status__in=['confirmed', 'active'],
-            start_date__lt=end_date,
-            end_date__gt=start_date
-        )
+        # The index rounds bookings out to whole hours and may still count one
+        # another process cancelled, so only its free answers are final
+        from . import occupancy
+        if occupancy.is_enabled():
+            index = occupancy.get_index()
+            if index.covers(start_date, end_date) and index.is_free(self.pk, start_date, end_date):
+                return True
+
+        overlapping_bookings = self.bookings.occupying().overlapping(start_date, end_date)
         return not overlapping_bookings.exists()
 
     def update_availability(self):
         """Update vehicle availability based on current bookings"""
         now = timezone.now()
         active_bookings = self.bookings.filter(
-            status__in=['confirmed', 'active'],
+            status__in=Booking.OCCUPYING_STATUSES,
             start_date__lte=now,
             end_date__gt=now
         )
@@ -111,16 +192,52 @@ class Vehicle(models.Model):
         else:
             # Check if there are any future bookings
             future_bookings = self.bookings.filter(
-                status__in=['confirmed'],
+                status__in=Booking.OCCUPYING_STATUSES,
                 start_date__gt=now
             )
             self.is_available = not future_bookings.exists()
         
         self.save(update_fields=['is_available'])
 
+# Booking fields whose changes invalidate the stored costs or the vehicle's availability
+PRICING_FIELDS = ('vehicle_id', 'start_date', 'end_date', 'drive_type')
+AVAILABILITY_FIELDS = ('vehicle_id', 'status', 'start_date', 'end_date')
+TRACKED_FIELDS = tuple(dict.fromkeys(PRICING_FIELDS + AVAILABILITY_FIELDS))
+COST_FIELDS = ('total_days', 'vehicle_cost', 'chauffeur_cost', 'total_cost')
+
+class BookingQuerySet(models.QuerySet):
+    def occupying(self):
+        """Bookings that take the vehicle out of circulation, including unexpired holds"""
+        return self.filter(Q(status__in=Booking.OCCUPYING_STATUSES) |
+                           Q(status='held', hold_expires_at__gt=timezone.now()))
+
+    def with_effective_status(self):
+        """Annotate ``effective_status``: the status maintenance will have persisted by now
+
+        Active bookings past their end read as completed and lapsed holds as
+        cancelled, so listings stay correct between maintenance runs without
+        writing on read.
+        """
+        now = timezone.now()
+        return self.annotate(effective_status=Case(
+            When(status='active', end_date__lt=now, then=Value('completed')),
+            When(status='held', hold_expires_at__lte=now, then=Value('cancelled')),
+            default=F('status'),
+            output_field=models.CharField(),
+        ))
+
+    def expired_holds(self):
+        """Holds whose payment window has passed"""
+        return self.filter(status='held', hold_expires_at__lte=timezone.now())
+
+    def overlapping(self, start_date, end_date):
+        """Bookings whose rental period intersects the given range"""
+        return self.filter(start_date__lt=end_date, end_date__gt=start_date)
+
 class Booking(models.Model):
     STATUS_CHOICES = (
         ('pending', 'Pending Payment'),
+        ('held', 'Held for Payment'),
         ('confirmed', 'Confirmed'),
         ('active', 'Active'),
         ('completed', 'Completed'),
@@ -132,7 +249,10 @@ class Booking(models.Model):
         ('chauffeur', 'With Chauffeur'),
     )
 
-    booking_id = models.UUIDField(default=uuid.uuid4, editable=False)
+    # Statuses that block the vehicle for the booked period
+    OCCUPYING_STATUSES = ('confirmed', 'active')
+
+    booking_id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
     client = models.ForeignKey(User, on_delete=models.CASCADE, related_name='bookings')
     vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name='bookings')
     pickup_location = models.ForeignKey(Location, on_delete=models.CASCADE, related_name='pickup_bookings')
@@ -145,29 +265,104 @@ class Booking(models.Model):
     chauffeur_cost = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     total_cost = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    hold_expires_at = models.DateTimeField(null=True, blank=True,
+                                           help_text="A held booking blocks the vehicle until this time")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = BookingQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Overlap checks for any set of statuses, including occupying() with its held branch
+            models.Index(fields=['vehicle', 'status', 'start_date', 'end_date'],
+                         name='booking_vehicle_overlap_idx'),
+            models.Index(fields=['hold_expires_at'], condition=Q(status='held'),
+                         name='booking_hold_expiry_idx'),
+            # Keyset pages of my_bookings, newest first, for admins and for one client
+            models.Index(fields=['created_at', 'id'], name='booking_created_idx'),
+            models.Index(fields=['client', 'created_at', 'id'], name='booking_client_created_idx'),
+            # Boundary lookups for the incremental availability refresh
+            models.Index(fields=['start_date'], name='booking_start_idx'),
+            models.Index(fields=['end_date'], name='booking_end_idx'),
+        ]
+
     def __str__(self):
         return f"Booking {self.booking_id} - {self.vehicle}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        booking = super().from_db(db, field_names, values)
+        booking._loaded = booking._tracked_values()
+        return booking
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+        # The refreshed values are what is in the database now
+        names = TRACKED_FIELDS if fields is None else {self._meta.get_field(name).attname for name in fields}
+        self._loaded = {**getattr(self, '_loaded', {}), **self._tracked_values(names)}
+
+    def _tracked_values(self, names=TRACKED_FIELDS):
+        return {name: self.__dict__[name] for name in names if name in self.__dict__}
+
+    def changed_fields(self):
+        """Pricing and availability inputs that differ from the values loaded from the database"""
+        if self._state.adding or not hasattr(self, '_loaded'):
+            return set(TRACKED_FIELDS)
+        return {name for name, value in self._tracked_values().items()
+                if name not in self._loaded or self._loaded[name] != value}
+
+    def calculate_costs(self):
+        """Set total_days and the cost fields from the current rate tables"""
+        if not self.total_days or not self._state.adding:
+            self.total_days = pricing.rental_days(self.start_date, self.end_date)
+
+        quote = pricing.quote(self.vehicle, self.start_date, self.end_date, self.drive_type, self.total_days)
+        self.vehicle_cost = quote.vehicle_cost
+        self.chauffeur_cost = quote.chauffeur_cost
+        self.total_cost = quote.total_cost
+
     def save(self, *args, **kwargs):
-        if not self.total_days:
-            delta = self.end_date.date() - self.start_date.date()
-            self.total_days = max(1, delta.days)
-        
-        self.vehicle_cost = self.vehicle.daily_rate * self.total_days
-        
-        if self.drive_type == 'chauffeur':
-            self.chauffeur_cost = 1000 * self.total_days
-        else:
-            self.chauffeur_cost = 0
-            
-        self.total_cost = self.vehicle_cost + self.chauffeur_cost
+        changed = self.changed_fields()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            update_fields = {self._meta.get_field(name).attname for name in update_fields}
+            changed &= update_fields
+
+        if changed & set(PRICING_FIELDS):
+            self.calculate_costs()
+            if update_fields is not None:
+                update_fields |= set(COST_FIELDS)
+        if update_fields is not None:
+            kwargs['update_fields'] = update_fields
+
+        loaded = getattr(self, '_loaded', {})
+        previous_vehicle_id = loaded.get('vehicle_id') if 'vehicle_id' in changed else None
         super().save(*args, **kwargs)
-        
-        # Update vehicle availability after saving booking
-        self.vehicle.update_availability()
+        saved = TRACKED_FIELDS if update_fields is None else update_fields
+        self._loaded = {**loaded, **self._tracked_values(saved)}
+
+        # Only a change of status, dates or vehicle can change whether the vehicle is free
+        if changed & set(AVAILABILITY_FIELDS) and availability_mode() == 'materialized':
+            self.vehicle.update_availability()
+            if previous_vehicle_id is not None:
+                Vehicle.objects.get(pk=previous_vehicle_id).update_availability()
+
+    def hold(self, minutes=None):
+        """Block the vehicle for a short payment window"""
+        minutes = minutes or getattr(settings, 'BOOKING_HOLD_MINUTES', 15)
+        self.status = 'held'
+        self.hold_expires_at = timezone.now() + timedelta(minutes=minutes)
+
+    def occupies(self):
+        """Check if booking currently takes the vehicle out of circulation"""
+        if self.status == 'held':
+            return self.hold_expires_at is not None and self.hold_expires_at > timezone.now()
+        return self.status in self.OCCUPYING_STATUSES
+
+    def get_effective_status_display(self):
+        status = getattr(self, 'effective_status', self.status)
+        return dict(self.STATUS_CHOICES).get(status, status)
 
     def is_expired(self):
         """Check if booking period has ended"""
@@ -177,9 +372,20 @@ class Booking(models.Model):
         """Update booking status to completed if period has ended"""
         if self.status == 'active' and self.is_expired():
             self.status = 'completed'
-            self.save(update_fields=['status'])
-            # Update vehicle availability
-            self.vehicle.update_availability()
+            self.save(update_fields=['status', 'updated_at'])
+
+# Blank references belong to payments not yet sent to Paystack
+REFERENCED = ~Q(paystack_reference='')
+
+
+class PaymentQuerySet(models.QuerySet):
+    def referenced(self):
+        """Payments sent to the gateway; repeating the unique index's condition lets every backend use it"""
+        return self.filter(REFERENCED)
+
+    def by_reference(self, reference):
+        return self.referenced().filter(paystack_reference=reference)
+
 
 class Payment(models.Model):
     STATUS_CHOICES = (
@@ -207,8 +413,21 @@ class Payment(models.Model):
     failure_reason = models.TextField(blank=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
+    processing_at = models.DateTimeField(null=True, blank=True, help_text="When the payment was last sent to Paystack")
     completed_at = models.DateTimeField(null=True, blank=True)
 
+    objects = PaymentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Stale payments for reconcile_payments
+            models.Index(fields=['processing_at'], condition=Q(status='processing'), name='payment_processing_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['paystack_reference'], condition=REFERENCED,
+                                    name='payment_paystack_ref_uniq'),
+        ]
+
     def __str__(self):
         return f"Payment {self.paystack_reference} - {self.status}"
 
@@ -218,6 +437,7 @@ class DrivingLicense(models.Model):
         ('pending', 'Pending Verification'),
         ('verified', 'Verified'),
         ('rejected', 'Rejected'),
+        ('expired', 'Expired'),
     )
 
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='license')
@@ -233,3 +453,42 @@ class DrivingLicense(models.Model):
 
     def __str__(self):
         return f"License for {self.user.username}"
+
+
+class WebhookEvent(models.Model):
+    """A verified gateway webhook, stored as received and applied later by ``process_webhooks``"""
+    event = models.CharField(max_length=50)
+    # The gateway's id for the transaction; with event and reference it identifies a delivery
+    gateway_id = models.CharField(max_length=50, blank=True)
+    reference = models.CharField(max_length=100, blank=True)
+    payload = models.TextField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            # The inbox: only unprocessed events, oldest first
+            models.Index(fields=['received_at', 'id'], condition=Q(processed_at__isnull=True),
+                         name='webhook_event_pending_idx'),
+            models.Index(fields=['processed_at'], name='webhook_event_processed_idx'),
+        ]
+        constraints = [
+            # Redeliveries of the same event are dropped on insert; without an id or a reference nothing matches
+            models.UniqueConstraint(fields=['event', 'gateway_id', 'reference'], name='webhook_event_uniq',
+                                    condition=~Q(gateway_id='', reference='')),
+        ]
+
+    def __str__(self):
+        return f"{self.event} {self.reference}"
+
+
+class Watermark(models.Model):
+    """How far a periodic job has processed, so the next run can start from there"""
+    name = models.CharField(max_length=50, unique=True)
+    value = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.value}"
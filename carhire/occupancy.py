@@ -0,0 +1,224 @@
+"""In-process fleet occupancy index.
+
+Every vehicle gets a bitset with one bit per hour over a rolling horizon,
+stored as a Python integer so range checks are a single AND against a mask.
+Bookings are marked conservatively (start rounded down, end rounded up), so
+the index never reports a vehicle as free when an occupying booking
+overlaps the range. A busy answer may be wrong (rounding, or a booking
+cancelled by another process), so callers only trust the index to say a
+vehicle is free and check busy vehicles against the database.
+
+The index lives in the worker process. Booking signals keep it current for
+writes made by the same process, and every write that newly occupies hours
+(a new booking, or one moved or extended onto other dates) bumps a
+generation in the cache so the other processes rebuild before answering
+again. Confirming a held booking or shortening one frees nothing the other
+indexes rely on, so those writes leave the generation alone. That only works through a cache shared by all workers, so the index is
+disabled on per-process backends. It is also rebuilt once it is older than
+OCCUPANCY_INDEX_MAX_AGE seconds or by ``manage.py occupancy_index --rebuild``.
+"""
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.utils import timezone
+
+from . import caching
+
+SLOT = timedelta(hours=1)
+GENERATION_KEY = 'carhire:occupancy:generation'
+
+_lock = threading.Lock()
+_index = None
+
+
+def _floor_hour(value):
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+class OccupancyIndex:
+    """Per-vehicle hourly occupancy bitsets over a fixed window"""
+
+    def __init__(self, origin, horizon_days):
+        self.origin = _floor_hour(origin)
+        self.size = horizon_days * 24
+        self.end = self.origin + self.size * SLOT
+        self.bits = {}
+        self.intervals = {}
+        self.owners = {}
+        self.built_at = time.monotonic()
+        self.generation = None
+
+    @classmethod
+    def build(cls, horizon_days=None, now=None):
+        """Load all occupying bookings that touch the horizon"""
+        from .models import Booking
+
+        horizon_days = horizon_days or settings.OCCUPANCY_INDEX_HORIZON_DAYS
+        index = cls(now or timezone.now(), horizon_days)
+        bookings = Booking.objects.occupying().overlapping(index.origin, index.end).values_list(
+            'id', 'vehicle_id', 'start_date', 'end_date'
+        )
+        for booking_id, vehicle_id, start_date, end_date in bookings.iterator():
+            index.intervals.setdefault(vehicle_id, {})[booking_id] = (start_date, end_date)
+            index.owners[booking_id] = vehicle_id
+        for vehicle_id in index.intervals:
+            index._refresh(vehicle_id)
+        return index
+
+    def _slots(self, start_date, end_date):
+        """Half-open slot range covering the datetimes, clamped to the horizon"""
+        first = int((start_date - self.origin) // SLOT)
+        last = -int(-(end_date - self.origin) // SLOT)
+        return max(first, 0), min(last, self.size)
+
+    def _mask(self, start_date, end_date):
+        first, last = self._slots(start_date, end_date)
+        if last <= first:
+            return 0
+        return ((1 << (last - first)) - 1) << first
+
+    def _refresh(self, vehicle_id):
+        bits = 0
+        for start_date, end_date in self.intervals.get(vehicle_id, {}).values():
+            bits |= self._mask(start_date, end_date)
+        if bits:
+            self.bits[vehicle_id] = bits
+        else:
+            self.bits.pop(vehicle_id, None)
+            self.intervals.pop(vehicle_id, None)
+
+    def covers(self, start_date, end_date):
+        """Whether the range lies inside the indexed horizon"""
+        return self.origin <= start_date and end_date <= self.end
+
+    def update(self, booking):
+        """Mark or unmark a booking after it was saved"""
+        self.discard(booking)
+        if booking.occupies():
+            self.intervals.setdefault(booking.vehicle_id, {})[booking.pk] = (booking.start_date, booking.end_date)
+            self.owners[booking.pk] = booking.vehicle_id
+            self._refresh(booking.vehicle_id)
+
+    def discard(self, booking):
+        """Unmark a booking, wherever it was indexed"""
+        vehicle_id = self.owners.pop(booking.pk, None)
+        if vehicle_id is not None:
+            self.intervals.get(vehicle_id, {}).pop(booking.pk, None)
+            self._refresh(vehicle_id)
+
+    def is_free(self, vehicle_id, start_date, end_date):
+        return not self.bits.get(vehicle_id, 0) & self._mask(start_date, end_date)
+
+    def busy_vehicles(self, start_date, end_date):
+        """Ids of vehicles with any occupied slot in the range"""
+        mask = self._mask(start_date, end_date)
+        return {vehicle_id for vehicle_id, bits in self.bits.items() if bits & mask}
+
+    def stats(self):
+        return {
+            'vehicles': len(self.bits),
+            'bookings': sum(len(booked) for booked in self.intervals.values()),
+            'slots': self.size,
+            'bytes': sum((bits.bit_length() + 7) // 8 for bits in self.bits.values()),
+        }
+
+
+def is_enabled():
+    return getattr(settings, 'OCCUPANCY_INDEX_ENABLED', False) and caching.is_shared(caches[DEFAULT_CACHE_ALIAS])
+
+
+def _is_stale(index, generation):
+    return (
+        index is None
+        or time.monotonic() - index.built_at > settings.OCCUPANCY_INDEX_MAX_AGE
+        or _floor_hour(timezone.now()) > index.origin
+        or index.generation != generation
+    )
+
+
+def get_index():
+    """Return the process index, rebuilding it when stale"""
+    global _index
+    generation = cache.get(GENERATION_KEY)
+    index = _index
+    if _is_stale(index, generation):
+        with _lock:
+            # Another thread may have rebuilt it while this one waited
+            generation = cache.get(GENERATION_KEY)
+            index = _index
+            if _is_stale(index, generation):
+                index = OccupancyIndex.build()
+                index.generation = generation
+                _index = index
+    return index
+
+
+def _bump_generation():
+    generation = time.time_ns()
+    cache.set(GENERATION_KEY, generation, None)
+    return generation
+
+
+def invalidate():
+    """Ask every process sharing the cache to rebuild its index"""
+    global _index
+    _index = None
+    _bump_generation()
+
+
+def _newly_occupies(booking):
+    """Whether a just-saved booking occupies hours its previous state did not"""
+    if not booking.occupies():
+        return False
+    # Booking.save() replaces the snapshot of loaded values only after post_save
+    loaded = getattr(booking, '_loaded', {})
+    if any(name not in loaded for name in ('vehicle_id', 'status', 'start_date', 'end_date')):
+        return True
+    status = loaded['status']
+    was_occupying = status in booking.OCCUPYING_STATUSES or (
+        status == 'held' and booking.hold_expires_at is not None and booking.hold_expires_at > timezone.now())
+    within = (loaded['vehicle_id'] == booking.vehicle_id and loaded['start_date'] <= booking.start_date
+              and booking.end_date <= loaded['end_date'])
+    return not (was_occupying and within)
+
+
+def booking_saved(booking):
+    # Other processes would otherwise report these dates free until their index ages out
+    generation = _bump_generation() if is_enabled() and _newly_occupies(booking) else None
+    if _index is not None:
+        with _lock:
+            _index.update(booking)
+            if generation is not None:
+                _index.generation = generation
+
+
+def booking_deleted(booking):
+    if _index is not None:
+        with _lock:
+            _index.discard(booking)
+
+
+def check_consistency(windows, index=None):
+    """Compare an index with overlap queries for the given hour-aligned windows
+
+    By default the live index of this process is checked, the one booking
+    signals have been patching since it was built.
+
+    Returns a list of ``(start, end, missing, extra)`` tuples for every window
+    where the busy vehicle ids differ from the database.
+    """
+    from .models import Booking
+
+    index = index or get_index()
+    mismatches = []
+    for start_date, end_date in windows:
+        expected = set(
+            Booking.objects.occupying().overlapping(start_date, end_date).values_list('vehicle_id', flat=True)
+        )
+        actual = index.busy_vehicles(start_date, end_date)
+        if expected != actual:
+            mismatches.append((start_date, end_date, expected - actual, actual - expected))
+    return mismatches
@@ -0,0 +1,120 @@
+"""Keyset (cursor) pagination.
+
+Instead of COUNT(*) plus OFFSET, each page is fetched with a WHERE clause
+that continues after the last row of the previous page, so page N costs the
+same as page 1. Cursors are opaque url-safe tokens holding the ordering
+values of the row to continue from and the direction to move in.
+"""
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class CursorPage:
+    """One page of results plus the tokens to reach its neighbours"""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+
+class CursorPaginator:
+    """Paginate a queryset by a unique ordering such as ('-created_at', '-id')"""
+
+    def __init__(self, queryset, per_page, ordering=('-created_at', '-id')):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = tuple(ordering)
+        self.fields = [name.lstrip('-') for name in self.ordering]
+
+    def encode(self, obj, direction):
+        values = [getattr(obj, name) for name in self.fields]
+        payload = json.dumps({'d': direction, 'v': [str(value) for value in values]})
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            direction, raw_values = payload['d'], payload['v']
+            if direction not in ('n', 'p') or len(raw_values) != len(self.fields):
+                raise InvalidCursor(cursor)
+            values = [self._field(name).to_python(value) for name, value in zip(self.fields, raw_values)]
+        except (binascii.Error, ValueError, KeyError, TypeError, ValidationError) as e:
+            raise InvalidCursor(cursor) from e
+        return direction, values
+
+    def _field(self, name):
+        if name in self.queryset.query.annotations:
+            return self.queryset.query.annotations[name].output_field
+        opts = self.queryset.model._meta
+        return opts.pk if name == 'pk' else opts.get_field(name)
+
+    def _after(self, values, reverse=False):
+        """Rows strictly beyond ``values`` in the ordering (or before it)"""
+        condition = Q()
+        equal = Q()
+        for ordering, name, value in zip(self.ordering, self.fields, values):
+            descending = ordering.startswith('-') != reverse
+            condition |= equal & Q(**{f'{name}__{"lt" if descending else "gt"}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def page(self, cursor=None):
+        """Return the page a cursor points at; bad or missing cursors give the first page"""
+        direction, values = 'n', None
+        if cursor:
+            try:
+                direction, values = self.decode(cursor)
+            except InvalidCursor:
+                pass
+
+        queryset = self.queryset
+        if direction == 'p':
+            reversed_ordering = [name[1:] if name.startswith('-') else f'-{name}' for name in self.ordering]
+            queryset = queryset.filter(self._after(values, reverse=True)).order_by(*reversed_ordering)
+        else:
+            if values is not None:
+                queryset = queryset.filter(self._after(values))
+            queryset = queryset.order_by(*self.ordering)
+
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if direction == 'p':
+            rows.reverse()
+
+        if not rows:
+            return CursorPage(rows)
+        more_after = has_more if direction == 'n' else True
+        more_before = values is not None if direction == 'n' else has_more
+        return CursorPage(
+            rows,
+            next_cursor=self.encode(rows[-1], 'n') if more_after else None,
+            previous_cursor=self.encode(rows[0], 'p') if more_before else None,
+        )
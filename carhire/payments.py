@@ -0,0 +1,78 @@
+"""Payment state transitions.
+
+Every transition is one conditional UPDATE, ``... SET status = %s WHERE
+status IN (...)``, and the affected row count says whether this caller made
+it. When the payment callback and the webhook race for the same reference,
+both issue the UPDATE but only one matches, so only that one goes on to
+confirm the booking, in the same transaction. The loser does nothing and can
+read the winner's result.
+
+    pending, processing, failed -> processing   (sent to the gateway)
+    pending, processing, failed -> completed
+    pending, processing -> failed
+
+A completed payment never changes again; a late success for a failed payment
+is still honoured because the customer was charged.
+"""
+import json
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Booking, Payment
+from .reservations import ReservationConflict, confirm
+
+SOURCES = {
+    # Processing payments may be sent again with a new reference
+    'processing': ('pending', 'processing', 'failed'),
+    'completed': ('pending', 'processing', 'failed'),
+    'failed': ('pending', 'processing'),
+}
+
+
+def transition(payments, status, **fields):
+    """Move the ``payments`` queryset to ``status`` where allowed; returns the number of rows moved"""
+    return payments.filter(status__in=SOURCES[status]).update(status=status, **fields)
+
+
+def start(payment, reference, access_code):
+    """Record the gateway reference of a payment that was just initialized"""
+    now = timezone.now()
+    moved = transition(Payment.objects.filter(pk=payment.pk), 'processing', processing_at=now,
+                       paystack_reference=reference, paystack_access_code=access_code)
+    if moved:
+        payment.status, payment.processing_at = 'processing', now
+        payment.paystack_reference, payment.paystack_access_code = reference, access_code
+    return bool(moved)
+
+
+def complete(reference, data):
+    """Complete the payment and confirm its booking; False if another caller already completed it
+
+    Raises ReservationConflict when the payment was completed here but the
+    booking's dates were taken in the meantime. The payment stays completed.
+    Raises ReservationBusy when the vehicle could not be locked; nothing is
+    saved and the payment stays as it was, to be completed by a later retry.
+    """
+    conflict = None
+    with transaction.atomic():
+        moved = transition(Payment.objects.by_reference(reference), 'completed',
+                           completed_at=timezone.now(), gateway_response=json.dumps(data))
+        if not moved:
+            return False
+        booking = Booking.objects.get(payment__in=Payment.objects.by_reference(reference))
+        try:
+            confirm(booking)
+        except ReservationConflict as e:
+            conflict = e
+    if conflict:
+        raise conflict
+    return True
+
+
+def fail(reference, reason, data=None):
+    """Mark an unfinished payment failed; False if it was already completed or failed"""
+    fields = {'failure_reason': reason}
+    if data is not None:
+        fields['gateway_response'] = json.dumps(data)
+    return bool(transition(Payment.objects.by_reference(reference), 'failed', **fields))
@@ -0,0 +1,127 @@
+"""Booking prices from rate tables.
+
+The tables come from the PRICING_* settings and are parsed once per process;
+call ``invalidate()`` after changing them at runtime (override_settings does
+so automatically). Quotes never touch the database, so a whole page of search
+results can be priced in one pass with ``quote_many()``.
+
+A quote is built as:
+
+    vehicle_cost = daily_rate * (1 + category surcharge) * sum(seasonal multiplier of each day)
+                   less the long-rental discount for the number of days
+    chauffeur_cost = chauffeur daily rate * days, for chauffeur bookings
+"""
+from collections import namedtuple
+from datetime import timedelta
+from decimal import Decimal
+import threading
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+CENT = Decimal('0.01')
+
+Quote = namedtuple('Quote', ['total_days', 'vehicle_cost', 'chauffeur_cost', 'total_cost'])
+RateTables = namedtuple('RateTables', ['chauffeur_daily_rate', 'category_surcharges', 'long_rental_discounts',
+                                       'seasons'])
+
+_tables = None
+_lock = threading.Lock()
+
+
+def _month_day(value):
+    month, day = value.split('-')
+    return int(month), int(day)
+
+
+def load():
+    """Parse the rate tables from settings"""
+    discounts = getattr(settings, 'PRICING_LONG_RENTAL_DISCOUNTS', {})
+    return RateTables(
+        chauffeur_daily_rate=Decimal(str(getattr(settings, 'PRICING_CHAUFFEUR_DAILY_RATE', 1000))),
+        category_surcharges={category: Decimal(str(surcharge)) for category, surcharge
+                             in getattr(settings, 'PRICING_CATEGORY_SURCHARGES', {}).items()},
+        # Longest qualifying rental first
+        long_rental_discounts=sorted(((int(days), Decimal(str(discount))) for days, discount in discounts.items()),
+                                     reverse=True),
+        seasons=[(_month_day(start), _month_day(end), Decimal(str(multiplier)))
+                 for start, end, multiplier in getattr(settings, 'PRICING_SEASONS', ())],
+    )
+
+
+def tables():
+    global _tables
+    if _tables is None:
+        with _lock:
+            if _tables is None:
+                _tables = load()
+    return _tables
+
+
+def invalidate():
+    """Reload the rate tables on next use"""
+    global _tables
+    _tables = None
+
+
+@receiver(setting_changed)
+def _pricing_setting_changed(setting, **kwargs):
+    if setting.startswith('PRICING_'):
+        invalidate()
+
+
+def rental_days(start_date, end_date):
+    """Billable days: calendar days between pickup and dropoff, at least one"""
+    return max(1, (end_date.date() - start_date.date()).days)
+
+
+def season_multiplier(day, rates=None):
+    """Multiplier for one calendar day; seasons may wrap the new year"""
+    key = (day.month, day.day)
+    for start, end, multiplier in (rates or tables()).seasons:
+        if (start <= key <= end) if start <= end else (key >= start or key <= end):
+            return multiplier
+    return Decimal(1)
+
+
+def _day_weight(start_date, total_days, rates):
+    """Sum of seasonal multipliers over the rental; 1 per day outside any season"""
+    if not rates.seasons:
+        return Decimal(total_days)
+    first = start_date.date()
+    return sum(season_multiplier(first + timedelta(days=i), rates) for i in range(total_days))
+
+
+def _discount(total_days, rates):
+    for min_days, discount in rates.long_rental_discounts:
+        if total_days >= min_days:
+            return discount
+    return Decimal(0)
+
+
+def _quote(daily_rate, category, total_days, day_weight, drive_type, rates):
+    vehicle_cost = daily_rate * (1 + rates.category_surcharges.get(category, 0)) * day_weight
+    vehicle_cost = (vehicle_cost * (1 - _discount(total_days, rates))).quantize(CENT)
+    chauffeur_cost = rates.chauffeur_daily_rate * total_days if drive_type == 'chauffeur' else Decimal(0)
+    return Quote(total_days, vehicle_cost, chauffeur_cost, vehicle_cost + chauffeur_cost)
+
+
+def quote(vehicle, start_date, end_date, drive_type, total_days=None):
+    """Price one vehicle for a rental"""
+    rates = tables()
+    total_days = total_days or rental_days(start_date, end_date)
+    return _quote(vehicle.daily_rate, vehicle.category, total_days, _day_weight(start_date, total_days, rates),
+                  drive_type, rates)
+
+
+def quote_many(vehicles, start_date, end_date, drive_type):
+    """Price every vehicle for the same rental, keyed by vehicle id"""
+    rates = tables()
+    total_days = rental_days(start_date, end_date)
+    # The calendar part of the price is shared, so it is computed once for the whole batch
+    day_weight = _day_weight(start_date, total_days, rates)
+    return {
+        vehicle.pk: _quote(vehicle.daily_rate, vehicle.category, total_days, day_weight, drive_type, rates)
+        for vehicle in vehicles
+    }
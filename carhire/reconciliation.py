@@ -0,0 +1,88 @@
+"""Settle payments left in ``processing``.
+
+A payment stays processing when the customer closes the tab before
+``payment_callback`` runs and the webhook never arrives. ``reconcile()``
+asks the gateway about every such payment older than a cut-off. The verify
+calls run concurrently on a bounded thread pool sharing the pooled Paystack
+session, and the answers are applied a batch at a time, one transaction per
+batch, through the ``payments`` transitions. A payment the callback or
+webhook settles in the meantime is simply left alone.
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+
+from . import metrics, payments
+from .models import Payment
+from .reservations import ReservationBusy, ReservationConflict
+from .utils import paystack
+
+logger = logging.getLogger(__name__)
+
+# Paystack transaction statuses that will not turn into a charge
+FAILED_STATUSES = ('failed', 'abandoned', 'reversed')
+
+
+def stale(now, minutes=30):
+    """Processing payments sent to the gateway more than ``minutes`` ago, oldest first"""
+    return Payment.objects.referenced().filter(
+        status='processing', processing_at__lt=now - timedelta(minutes=minutes)).order_by('processing_at')
+
+
+def settle(reference, result):
+    """Apply one verify result; returns 'completed', 'failed', 'conflict', 'skipped' or 'unresolved'
+
+    'skipped' means the callback or webhook settled the payment first.
+    """
+    if not result['success']:
+        return 'unresolved'
+    data = result['data']
+    if data.get('status') == 'success':
+        try:
+            return 'completed' if payments.complete(reference, data) else 'skipped'
+        except ReservationConflict:
+            logger.error(f"Payment {reference} completed but its booking lost its dates")
+            return 'conflict'
+        except ReservationBusy:
+            logger.warning(f"Payment {reference} left processing; its vehicle is locked by another request")
+            return 'unresolved'
+    if data.get('status') in FAILED_STATUSES:
+        reason = data.get('gateway_response') or f"Payment {data['status']}"
+        return 'failed' if payments.fail(reference, reason, data) else 'skipped'
+    # Still ongoing at the gateway
+    return 'unresolved'
+
+
+def reconcile(now, minutes=30, workers=None, batch_size=50, limit=None, client=None, progress=None):
+    """Verify stale processing payments concurrently and apply the outcomes in batches
+
+    Returns a dict with the number of payments checked, one count per
+    outcome of ``settle()`` and the elapsed seconds.
+    """
+    client = client or paystack
+    # More threads than pooled connections would only open throwaway connections
+    workers = workers or getattr(settings, 'PAYSTACK_POOL_SIZE', 10)
+    references = list(stale(now, minutes).values_list('paystack_reference', flat=True)[:limit])
+
+    started = time.perf_counter()
+    totals = dict.fromkeys(('completed', 'failed', 'conflict', 'skipped', 'unresolved'), 0)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for offset in range(0, len(references), batch_size):
+            batch = references[offset:offset + batch_size]
+            results = list(pool.map(client.verify_payment, batch))
+            with transaction.atomic():
+                outcomes = [settle(reference, result) for reference, result in zip(batch, results)]
+            for outcome in outcomes:
+                totals[outcome] += 1
+            if progress:
+                progress(offset + len(batch), len(references))
+
+    seconds = time.perf_counter() - started
+    metrics.timing('payments.reconcile', seconds * 1000)
+    metrics.gauge('payments.reconcile_unresolved', totals['unresolved'])
+    metrics.incr('payments.reconciled', totals['completed'] + totals['failed'] + totals['conflict'])
+    return {'checked': len(references), **totals, 'seconds': seconds}
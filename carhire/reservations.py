@@ -0,0 +1,143 @@
+"""Race-free booking reservation.
+
+``reserve()`` locks the vehicle row, rechecks for overlapping occupying
+bookings and saves, all in one transaction, so two requests for the same car
+can never both succeed. Where the database supports it the lock is taken with
+SELECT ... FOR UPDATE NOWAIT, so a competing request does not queue behind
+the winner. SQLite has no row locks; a no-op UPDATE of the vehicle takes the
+database write lock, which serializes the check and the insert in the same
+way. ``reserve_many()`` does the same for a fleet order, all vehicles or none.
+
+Taken dates raise ReservationConflict. Failing to get the lock says nothing
+about the dates, so it is retried a few times with backoff and then raised
+as ReservationBusy. Inside a caller's transaction there is nothing to retry
+on its own, so ReservationBusy is raised at once and the caller (a webhook
+batch, a reconciliation run) rolls back and tries again later.
+"""
+import time
+
+from django.conf import settings
+from django.db import OperationalError, connections, router, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import metrics, occupancy, search
+from .models import Booking, Vehicle, availability_mode
+
+
+class ReservationError(Exception):
+    def __init__(self, message, vehicle_ids=()):
+        super().__init__(message)
+        self.vehicle_ids = list(vehicle_ids)
+
+
+class ReservationConflict(ReservationError):
+    """The vehicle is booked for an overlapping period"""
+
+
+class ReservationBusy(ReservationError):
+    """The vehicle rows are locked by another transaction; the dates may still be free"""
+
+
+def _locked(using, vehicle_ids, operation):
+    """Run ``operation`` in a transaction, retrying when the lock or the database is busy"""
+    retries = 0 if connections[using].in_atomic_block else getattr(settings, 'RESERVATION_LOCK_RETRIES', 3)
+    for attempt in range(retries + 1):
+        try:
+            with transaction.atomic(using=using):
+                return operation()
+        except OperationalError as e:
+            # Lock held by a concurrent reservation (NOWAIT) or database busy
+            if attempt == retries:
+                metrics.incr('reservations.busy')
+                raise ReservationBusy("The vehicle is being booked by another request", vehicle_ids) from e
+            time.sleep(0.05 * 2 ** attempt)
+
+
+def lock_vehicles(vehicle_ids, using):
+    """Lock vehicle rows for the rest of the transaction, failing fast if any is held"""
+    if connections[using].features.has_select_for_update_nowait:
+        locked = Vehicle.objects.using(using).select_for_update(nowait=True).filter(pk__in=vehicle_ids)
+        list(locked.order_by('pk').values_list('pk', flat=True))
+    else:
+        Vehicle.objects.using(using).filter(pk__in=vehicle_ids).update(is_available=F('is_available'))
+
+
+def reserve(booking):
+    """Save ``booking`` unless an occupying booking already overlaps its dates"""
+    using = router.db_for_write(Booking, instance=booking)
+
+    def check_and_save():
+        lock_vehicles([booking.vehicle_id], using)
+        overlapping = Booking.objects.using(using).occupying().overlapping(
+            booking.start_date, booking.end_date
+        ).filter(vehicle_id=booking.vehicle_id)
+        if booking.pk is not None:
+            overlapping = overlapping.exclude(pk=booking.pk)
+        if overlapping.exists():
+            raise ReservationConflict(f"Vehicle {booking.vehicle_id} is already booked for these dates",
+                                      [booking.vehicle_id])
+        booking.save()
+
+    _locked(using, [booking.vehicle_id], check_and_save)
+    return booking
+
+
+def reserve_many(bookings):
+    """Insert bookings for several vehicles in one transaction, or none of them if any vehicle is taken
+
+    Availability is checked for every vehicle in one query and costs are
+    computed in memory, so each booking's ``vehicle`` must already be loaded.
+    """
+    vehicle_ids = sorted({booking.vehicle_id for booking in bookings})
+    using = router.db_for_write(Booking)
+    overlaps = Q()
+    for booking in bookings:
+        overlaps |= Q(vehicle_id=booking.vehicle_id, start_date__lt=booking.end_date, end_date__gt=booking.start_date)
+
+    def check_and_insert():
+        lock_vehicles(vehicle_ids, using)
+        taken = set(Booking.objects.using(using).occupying().filter(overlaps).values_list('vehicle_id', flat=True))
+        if taken:
+            raise ReservationConflict(f"{len(taken)} of the vehicles are already booked for these dates",
+                                      sorted(taken))
+        for booking in bookings:
+            booking.calculate_costs()
+        created = Booking.objects.using(using).bulk_create(bookings)
+        if availability_mode() == 'materialized':
+            Vehicle.objects.using(using).filter(pk__in=vehicle_ids).refresh_availability()
+        return created
+
+    created = _locked(using, vehicle_ids, check_and_insert)
+
+    # bulk_create() and update() send no signals
+    for booking in created:
+        occupancy.booking_saved(booking)
+    search.invalidate()
+    return created
+
+
+def confirm(booking):
+    """Move a paid booking to confirmed, unless its dates were taken in the meantime"""
+    previous_status = booking.status
+    booking.status = 'confirmed'
+    try:
+        return reserve(booking)
+    except ReservationError:
+        booking.status = previous_status
+        raise
+
+
+def expire_holds():
+    """Cancel every lapsed hold in one UPDATE and return how many were released"""
+    started = time.perf_counter()
+    expired = Booking.objects.expired_holds().update(status='cancelled', updated_at=timezone.now())
+    if expired:
+        # update() sends no signals, so drop the caches that still count these holds
+        occupancy.invalidate()
+        search.invalidate()
+
+    metrics.timing('holds.sweep', (time.perf_counter() - started) * 1000)
+    metrics.gauge('holds.last_sweep_rows', expired)
+    metrics.incr('holds.expired', expired)
+    return expired
@@ -0,0 +1,127 @@
+"""Vehicle search with a versioned result cache.
+
+Result pages are cached under the search parameters: the exact pickup and
+dropoff, the filters and sort order, and the page cursor. Every key also
+embeds a global version that Booking and Vehicle signals bump, so a write
+makes all earlier entries unreachable instead of serving them stale. Writes
+that bypass signals (queryset.update) must call ``invalidate()`` themselves.
+
+A version bumped in one worker has to reach all of them, so results are only
+cached when SEARCH_CACHE_ALIAS names a cache shared between processes; on a
+per-process backend every search runs against the database.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import caching, fulltext, metrics, occupancy
+from .models import Booking, Vehicle
+from .pagination import CursorPage, CursorPaginator
+
+VERSION_KEY = 'carhire:search:version'
+
+# Each ordering ends in the primary key so keyset cursors are unambiguous
+ORDERINGS = {
+    'relevance': ('-rank', '-id'),
+    'newest': ('-created_at', '-id'),
+    'price_asc': ('daily_rate', 'id'),
+    'price_desc': ('-daily_rate', '-id'),
+    'year_desc': ('-year', '-id'),
+}
+ORDERING = ORDERINGS['newest']
+FILTERS = ('pickup_location', 'category', 'min_price', 'max_price', 'min_year', 'max_year', 'condition', 'q',
+           'sort')
+
+
+def _cache():
+    return caches[getattr(settings, 'SEARCH_CACHE_ALIAS', 'default')]
+
+
+def available_vehicles(pickup_date, dropoff_date, pickup_location=None, category=None, min_price=None,
+                       max_price=None, min_year=None, max_year=None, condition=None, q=None, sort='newest'):
+    """Approved, available vehicles free for the whole range, in the requested order"""
+    vehicles = Vehicle.objects.listed()
+    if q:
+        vehicles = fulltext.match(vehicles, q)
+    elif sort == 'relevance':
+        sort = 'newest'
+    # Narrow to the pickup location first so availability only runs on that subset
+    if pickup_location is not None:
+        vehicles = vehicles.at_location(pickup_location)
+
+    if category:
+        vehicles = vehicles.filter(category=category)
+    if condition:
+        vehicles = vehicles.filter(condition=condition)
+    if min_price is not None:
+        vehicles = vehicles.filter(daily_rate__gte=min_price)
+    if max_price is not None:
+        vehicles = vehicles.filter(daily_rate__lte=max_price)
+    if min_year is not None:
+        vehicles = vehicles.filter(year__gte=min_year)
+    if max_year is not None:
+        vehicles = vehicles.filter(year__lte=max_year)
+
+    index = occupancy.get_index() if occupancy.is_enabled() else None
+    if index is not None and index.covers(pickup_date, dropoff_date):
+        # Busy answers are hour-rounded, so check those vehicles' bookings exactly
+        busy = Booking.objects.occupying().overlapping(pickup_date, dropoff_date).filter(
+            vehicle_id__in=index.busy_vehicles(pickup_date, dropoff_date))
+        vehicles = vehicles.exclude(id__in=busy.values('vehicle_id'))
+    else:
+        vehicles = vehicles.available_between(pickup_date, dropoff_date)
+
+    return vehicles.order_by(*ORDERINGS[sort or 'newest'])
+
+
+def criteria(cleaned_data):
+    """Keyword arguments for available_vehicles() from a valid VehicleSearchForm"""
+    return {name: cleaned_data.get(name) for name in FILTERS}
+
+
+def version():
+    return _cache().get_or_set(VERSION_KEY, 1, None)
+
+
+def invalidate():
+    """Make every cached search result unreachable"""
+    cache = _cache()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 1, None)
+
+
+def cache_key(start, end, filters, cursor, per_page):
+    params = '&'.join(f'{name}={getattr(value, "pk", value)}' for name, value in sorted(filters.items())
+                      if value not in (None, ''))
+    digest = hashlib.md5(params.encode(), usedforsecurity=False).hexdigest()
+    return (f"carhire:search:v{version()}:{start:%Y%m%d%H%M%S}:{end:%Y%m%d%H%M%S}:{digest}:{per_page}:"
+            f"{cursor or 'first'}")
+
+
+def search_page(cleaned_data, cursor=None, per_page=9):
+    """One page of vehicles matching a valid VehicleSearchForm"""
+    start, end = cleaned_data['pickup_date'], cleaned_data['dropoff_date']
+    filters = criteria(cleaned_data)
+
+    cache = _cache()
+    if not caching.is_shared(cache):
+        vehicles = available_vehicles(start, end, **filters)
+        return CursorPaginator(vehicles, per_page, vehicles.query.order_by).page(cursor)
+
+    key = cache_key(start, end, filters, cursor, per_page)
+    cached = cache.get(key)
+    if cached is not None:
+        metrics.incr('search_cache.hits')
+        vehicle_ids, next_cursor, previous_cursor = cached
+        vehicles = Vehicle.objects.in_bulk(vehicle_ids)
+        return CursorPage([vehicles[i] for i in vehicle_ids if i in vehicles], next_cursor, previous_cursor)
+
+    metrics.incr('search_cache.misses')
+    vehicles = available_vehicles(start, end, **filters)
+    page = CursorPaginator(vehicles, per_page, vehicles.query.order_by).page(cursor)
+    cached = ([vehicle.id for vehicle in page], page.next_cursor, page.previous_cursor)
+    cache.set(key, cached, getattr(settings, 'SEARCH_CACHE_TIMEOUT', 300))
+    return page
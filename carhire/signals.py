@@ -0,0 +1,37 @@
+import logging
+
+from django.db.models.signals import post_migrate, post_save, post_delete
+from django.dispatch import receiver
+
+from . import fulltext, occupancy, search
+from .models import Booking, Vehicle
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=Booking)
+def index_booking(sender, instance, **kwargs):
+    """Keep the in-process occupancy index in step with booking writes"""
+    occupancy.booking_saved(instance)
+
+
+@receiver(post_delete, sender=Booking)
+def unindex_booking(sender, instance, **kwargs):
+    occupancy.booking_deleted(instance)
+
+
+@receiver(post_save, sender=Booking)
+@receiver(post_delete, sender=Booking)
+@receiver(post_save, sender=Vehicle)
+@receiver(post_delete, sender=Vehicle)
+def invalidate_search_cache(sender, **kwargs):
+    search.invalidate()
+
+
+@receiver(post_migrate)
+def restore_fulltext_sync(sender, using, **kwargs):
+    """Put back FTS triggers dropped when a migration rebuilt the vehicle table"""
+    if sender.name == 'carhire':
+        recreated = fulltext.ensure_sync(using)
+        if recreated:
+            logger.warning(f"Recreated full-text triggers {', '.join(recreated)} and rebuilt the index")
@@ -1,3 +1,1362 @@
-from django.test import TestCase
+import base64
+import copy
+import hashlib
+import hmac
+import io
+import json
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, OperationalError, connection
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (availability, fulltext, maintenance, metrics, occupancy, payments, pricing, reconciliation, reservations,
+               search, views, webhooks)
+from .benchmarking import seed_fleet
+from .forms import AvailabilityCalendarForm, VehicleSearchForm
+from .models import Booking, DrivingLicense, Location, Payment, User, Vehicle, Watermark, WebhookEvent
+from .pagination import CursorPaginator
+from .reservations import ReservationBusy, ReservationConflict, confirm, expire_holds, reserve
+from .utils import PaystackAPI
+
+
+class FleetTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create(username='owner', user_type='owner')
+        cls.client_user = User.objects.create(username='client', user_type='client')
+        cls.location = Location.objects.create(name='Airport', city='Nairobi')
+        cls.vehicle = cls.make_vehicle(daily_rate=Decimal('5000'))
+
+    @classmethod
+    def make_vehicle(cls, **fields):
+        defaults = dict(owner=cls.owner, make='Toyota', model='Prado', year=2020, category='suv',
+                        condition='good', mileage=1000, daily_rate=Decimal('5000'),
+                        is_approved=True, approval_status='approved')
+        return Vehicle.objects.create(**{**defaults, **fields})
+
+    def make_booking(self, days_from_now=1, days=3, **fields):
+        start = timezone.now() + timedelta(days=days_from_now)
+        defaults = dict(client=self.client_user, vehicle=self.vehicle, pickup_location=self.location,
+                        dropoff_location=self.location, start_date=start, end_date=start + timedelta(days=days),
+                        drive_type='self')
+        booking = Booking(**{**defaults, **fields})
+        booking.save()
+        return booking
+
+
+class BookingSaveTests(FleetTestCase):
+    def reload(self, booking):
+        return Booking.objects.get(pk=booking.pk)
+
+    def test_create_prices_booking_and_refreshes_availability(self):
+        start = timezone.now() + timedelta(days=1)
+        booking = Booking(client=self.client_user, vehicle=self.vehicle, pickup_location=self.location,
+                          dropoff_location=self.location, start_date=start, end_date=start + timedelta(days=3),
+                          drive_type='chauffeur')
+        # INSERT, two availability lookups and the vehicle UPDATE
+        with self.assertNumQueries(4):
+            booking.save()
+        self.assertEqual(booking.total_days, 3)
+        self.assertEqual(booking.vehicle_cost, Decimal('15000'))
+        self.assertEqual(booking.chauffeur_cost, 3000)
+        self.assertEqual(booking.total_cost, Decimal('18000'))
+
+    def test_unrelated_change_is_a_single_update(self):
+        booking = self.reload(self.make_booking())
+        booking.pickup_location = Location.objects.create(name='CBD', city='Nairobi')
+        with self.assertNumQueries(1):
+            booking.save()
+
+    def test_status_update_fields_skips_pricing(self):
+        booking = self.reload(self.make_booking())
+        booking.status = 'confirmed'
+        booking.total_cost = Decimal('1')
+        # UPDATE, vehicle load, two availability lookups and the vehicle UPDATE
+        with self.assertNumQueries(5):
+            booking.save(update_fields=['status'])
+        self.assertEqual(self.reload(booking).total_cost, Decimal('15000'))
+        self.vehicle.refresh_from_db()
+        self.assertFalse(self.vehicle.is_available)
+
+    def test_status_only_full_save_skips_pricing(self):
+        booking = self.reload(self.make_booking())
+        booking.status = 'cancelled'
+        with self.assertNumQueries(5):
+            booking.save()
+
+    def test_drive_type_change_reprices_without_availability(self):
+        booking = self.reload(self.make_booking())
+        booking.drive_type = 'chauffeur'
+        # Vehicle load for the rate, then the UPDATE
+        with self.assertNumQueries(2):
+            booking.save()
+        self.assertEqual(self.reload(booking).total_cost, Decimal('18000'))
+
+    def test_date_change_reprices_and_refreshes_availability(self):
+        booking = self.reload(self.make_booking())
+        booking.end_date = booking.start_date + timedelta(days=5)
+        with self.assertNumQueries(5):
+            booking.save()
+        booking = self.reload(booking)
+        self.assertEqual(booking.total_days, 5)
+        self.assertEqual(booking.total_cost, Decimal('25000'))
+
+    def test_vehicle_change_refreshes_both_vehicles(self):
+        other = self.make_vehicle(daily_rate=Decimal('7000'))
+        booking = self.reload(self.make_booking(status='confirmed'))
+        booking.vehicle = other
+        # UPDATE, availability for the new vehicle, then load and refresh the old one
+        with self.assertNumQueries(8):
+            booking.save()
+        self.assertEqual(self.reload(booking).total_cost, Decimal('21000'))
+        self.vehicle.refresh_from_db()
+        other.refresh_from_db()
+        self.assertTrue(self.vehicle.is_available)
+        self.assertFalse(other.is_available)
+
+    def test_second_save_without_changes_is_a_single_update(self):
+        booking = self.make_booking()
+        booking.status = 'confirmed'
+        booking.save()
+        with self.assertNumQueries(1):
+            booking.save()
+
+    def test_refresh_from_db_takes_the_refreshed_values_as_loaded(self):
+        booking = self.reload(self.make_booking(days=2))
+        original_end = booking.end_date
+        elsewhere = self.reload(booking)
+        elsewhere.end_date = booking.start_date + timedelta(days=5)
+        elsewhere.save()
+
+        booking.refresh_from_db()
+        booking.end_date = original_end
+        booking.save()
+        booking = self.reload(booking)
+        self.assertEqual((booking.end_date, booking.total_days, booking.total_cost),
+                         (original_end, 2, Decimal('10000')))
+
+    def test_expired_booking_completes_with_one_availability_refresh(self):
+        booking = self.make_booking(days_from_now=-5, days=2, status='active')
+        booking = self.reload(booking)
+        with self.assertNumQueries(5):
+            booking.update_status_if_expired()
+        self.assertEqual(self.reload(booking).status, 'completed')
+
+
+class PricingTests(SimpleTestCase):
+    def setUp(self):
+        self.suv = Vehicle(pk=1, daily_rate=Decimal('5000'), category='suv')
+        self.sedan = Vehicle(pk=2, daily_rate=Decimal('3000'), category='sedan')
+
+    def price(self, start, days, drive_type='self', vehicle=None):
+        start = timezone.make_aware(datetime(*start, 10))
+        return pricing.quote(vehicle or self.suv, start, start + timedelta(days=days), drive_type)
+
+    def test_default_tables_price_days_and_chauffeur(self):
+        self.assertEqual(self.price((2026, 3, 2), 3, 'chauffeur'),
+                         pricing.Quote(3, Decimal('15000.00'), Decimal('3000'), Decimal('18000.00')))
+
+    @override_settings(PRICING_CATEGORY_SURCHARGES={'suv': '0.20'})
+    def test_category_surcharge_applies_to_its_category_only(self):
+        self.assertEqual(self.price((2026, 3, 2), 2).vehicle_cost, Decimal('12000.00'))
+        self.assertEqual(self.price((2026, 3, 2), 2, vehicle=self.sedan).vehicle_cost, Decimal('6000.00'))
+
+    @override_settings(PRICING_LONG_RENTAL_DISCOUNTS={7: '0.05', 28: '0.15'})
+    def test_longest_qualifying_duration_discount_wins(self):
+        self.assertEqual(self.price((2026, 3, 2), 6).vehicle_cost, Decimal('30000.00'))
+        self.assertEqual(self.price((2026, 3, 2), 7).vehicle_cost, Decimal('33250.00'))
+        self.assertEqual(self.price((2026, 3, 2), 28).vehicle_cost, Decimal('119000.00'))
+
+    @override_settings(PRICING_SEASONS=[('12-20', '01-05', '1.5')])
+    def test_season_wrapping_the_new_year(self):
+        for day, multiplier in [((2026, 12, 19), 1), ((2026, 12, 20), Decimal('1.5')), ((2027, 1, 1), Decimal('1.5')),
+                                ((2027, 1, 5), Decimal('1.5')), ((2027, 1, 6), 1), ((2027, 7, 1), 1)]:
+            self.assertEqual(pricing.season_multiplier(date(*day)), multiplier, day)
+        # Dec 18-19 at the base rate, Dec 20-21 in season
+        self.assertEqual(self.price((2026, 12, 18), 4).vehicle_cost, Decimal('25000.00'))
+        quotes = pricing.quote_many([self.suv, self.sedan], timezone.make_aware(datetime(2026, 12, 18, 10)),
+                                    timezone.make_aware(datetime(2026, 12, 22, 10)), 'self')
+        self.assertEqual({pk: quote.vehicle_cost for pk, quote in quotes.items()},
+                         {1: Decimal('25000.00'), 2: Decimal('15000.00')})
+
+    def test_changed_settings_reload_the_tables(self):
+        before = pricing.tables()
+        self.assertIs(pricing.tables(), before)
+        with self.settings(PRICING_CHAUFFEUR_DAILY_RATE=2500):
+            self.assertEqual(pricing.tables().chauffeur_daily_rate, Decimal('2500'))
+            self.assertEqual(self.price((2026, 3, 2), 2, 'chauffeur').chauffeur_cost, Decimal('5000'))
+        self.assertEqual(pricing.tables().chauffeur_daily_rate, before.chauffeur_daily_rate)
+
+
+def shared_cache_settings(test):
+    """CACHES for a file-based cache, the simplest backend that every process can see"""
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    return {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                        'LOCATION': directory.name}}
+
+
+class OccupancyIndexTests(FleetTestCase):
+    def setUp(self):
+        self.day = occupancy._floor_hour(timezone.now()) + timedelta(days=2)
+        # 09:00-10:30 on the test day
+        self.booking = self.make_booking(start_date=self.day + timedelta(hours=9),
+                                         end_date=self.day + timedelta(hours=10, minutes=30), status='confirmed')
+        self.other = self.make_vehicle()
+
+    def at(self, hours, minutes=0):
+        return self.day + timedelta(hours=hours, minutes=minutes)
+
+    def test_bitsets_round_bookings_out_to_whole_hours(self):
+        index = occupancy.OccupancyIndex.build(horizon_days=7)
+        self.assertFalse(index.is_free(self.vehicle.pk, self.at(10, 45), self.at(12)))
+        self.assertTrue(index.is_free(self.vehicle.pk, self.at(11), self.at(12)))
+        self.assertTrue(index.is_free(self.vehicle.pk, self.at(7), self.at(9)))
+        self.assertTrue(index.is_free(self.other.pk, self.at(9), self.at(11)))
+        self.assertEqual(index.busy_vehicles(self.at(8), self.at(9, 30)), {self.vehicle.pk})
+        self.assertTrue(index.covers(self.at(0), self.at(24)))
+        self.assertFalse(index.covers(self.at(0), self.at(24 * 30)))
+
+    def test_update_and_discard_track_saved_bookings(self):
+        index = occupancy.OccupancyIndex.build(horizon_days=7)
+        self.booking.status = 'cancelled'
+        index.update(self.booking)
+        self.assertTrue(index.is_free(self.vehicle.pk, self.at(9), self.at(10)))
+        self.booking.status = 'confirmed'
+        index.update(self.booking)
+        self.assertFalse(index.is_free(self.vehicle.pk, self.at(9), self.at(10)))
+        index.discard(self.booking)
+        self.assertEqual(index.stats()['bookings'], 0)
+
+    def test_busy_answers_are_checked_against_the_database(self):
+        with self.settings(OCCUPANCY_INDEX_ENABLED=True, CACHES=shared_cache_settings(self)):
+            self.assertTrue(occupancy.is_enabled())
+            occupancy.invalidate()
+            self.assertFalse(self.vehicle.is_available_for_dates(self.at(10), self.at(11)))
+            # Free after the booking ends, although the index rounds it up to 11:00
+            self.assertTrue(self.vehicle.is_available_for_dates(self.at(10, 45), self.at(12)))
+            # Cancelled without signals, as another process would
+            Booking.objects.filter(pk=self.booking.pk).update(status='cancelled')
+            self.assertFalse(occupancy.get_index().is_free(self.vehicle.pk, self.at(9), self.at(10)))
+            self.assertTrue(self.vehicle.is_available_for_dates(self.at(9), self.at(10)))
+
+    def test_occupying_save_makes_other_processes_rebuild(self):
+        with self.settings(OCCUPANCY_INDEX_ENABLED=True, CACHES=shared_cache_settings(self)):
+            index = occupancy.get_index()
+            self.make_booking(vehicle=self.other, start_date=self.at(9), end_date=self.at(10), status='confirmed')
+            # This process's index was updated in place; another process sees a new generation
+            self.assertIs(occupancy.get_index(), index)
+            self.assertFalse(index.is_free(self.other.pk, self.at(9), self.at(10)))
+            index.generation = None
+            self.assertIsNot(occupancy.get_index(), index)
+
+    def test_generation_is_bumped_only_for_newly_occupied_hours(self):
+        with self.settings(OCCUPANCY_INDEX_ENABLED=True, CACHES=shared_cache_settings(self)):
+            occupancy.get_index()
+            held = self.make_booking(vehicle=self.other, start_date=self.at(9), end_date=self.at(12), status='held',
+                                     hold_expires_at=timezone.now() + timedelta(minutes=15))
+            generation = cache.get(occupancy.GENERATION_KEY)
+            # Paying for a hold, shortening or cancelling frees nothing another index still counts as free
+            held.status = 'confirmed'
+            held.save()
+            held.end_date = self.at(11)
+            held.save()
+            held.status = 'cancelled'
+            held.save()
+            self.assertEqual(cache.get(occupancy.GENERATION_KEY), generation)
+
+            self.booking.end_date = self.at(13)
+            self.booking.save()
+            self.assertNotEqual(cache.get(occupancy.GENERATION_KEY), generation)
+
+    def test_check_finds_writes_the_live_index_missed(self):
+        with self.settings(OCCUPANCY_INDEX_ENABLED=True, CACHES=shared_cache_settings(self)):
+            windows = [(self.at(hour), self.at(hour + 1)) for hour in range(6, 18)]
+            occupancy.get_index()
+            self.assertEqual(occupancy.check_consistency(windows), [])
+            call_command('occupancy_index', check=True, windows=20, stdout=io.StringIO())
+            # Moved to another vehicle without signals, as a raw update would
+            Booking.objects.filter(pk=self.booking.pk).update(vehicle=self.other)
+            self.assertEqual(len(occupancy.check_consistency(windows)), 2)
+            with self.assertRaises(CommandError):
+                call_command('occupancy_index', check=True, windows=500, stdout=io.StringIO(), stderr=io.StringIO())
+
+    def test_index_is_disabled_on_a_per_process_cache(self):
+        with self.settings(OCCUPANCY_INDEX_ENABLED=True):
+            self.assertFalse(occupancy.is_enabled())
+
+    def test_concurrent_callers_build_the_index_once(self):
+        occupancy._index = None
+        self.addCleanup(setattr, occupancy, '_index', None)
+        builds = []
+
+        def slow_build(*args, **kwargs):
+            builds.append(1)
+            time.sleep(0.1)
+            return occupancy.OccupancyIndex(timezone.now(), 1)
+
+        with mock.patch.object(occupancy.OccupancyIndex, 'build', slow_build), \
+                ThreadPoolExecutor(max_workers=4) as pool:
+            indexes = list(pool.map(lambda _: occupancy.get_index(), range(4)))
+        self.assertEqual(len(builds), 1)
+        self.assertEqual(len({id(index) for index in indexes}), 1)
+
+
+class VehicleLocationTests(FleetTestCase):
+    def test_vehicles_without_locations_are_found_everywhere(self):
+        elsewhere = Location.objects.create(name='CBD', city='Nairobi')
+        pinned = self.make_vehicle()
+        pinned.locations.add(self.location)
+        start = timezone.now() + timedelta(days=1)
+
+        self.assertEqual(set(Vehicle.objects.at_location(self.location)), {self.vehicle, pinned})
+        self.assertEqual(list(Vehicle.objects.at_location(elsewhere)), [self.vehicle])
+        found = search.available_vehicles(start, start + timedelta(days=2), pickup_location=elsewhere)
+        self.assertEqual(list(found), [self.vehicle])
+
+
+class VehicleSearchTests(FleetTestCase):
+    def setUp(self):
+        self.cheap = self.make_vehicle(daily_rate=Decimal('3000'), year=2018, condition='fair')
+        self.twin = self.make_vehicle(daily_rate=Decimal('5000'), year=2022, condition='excellent')
+        self.premium = self.make_vehicle(daily_rate=Decimal('9000'), year=2024, condition='excellent')
+        self.start = timezone.now() + timedelta(days=1)
+        self.end = self.start + timedelta(days=2)
+        busy = self.make_vehicle(daily_rate=Decimal('4000'))
+        self.make_booking(vehicle=busy, start_date=self.start, end_date=self.end, status='confirmed')
+
+    def found(self, **filters):
+        return list(search.available_vehicles(self.start, self.end, **filters))
+
+    def test_filters_are_inclusive_and_combine(self):
+        self.assertEqual(set(self.found(min_price=Decimal('5000'), max_price=Decimal('9000'))),
+                         {self.vehicle, self.twin, self.premium})
+        self.assertEqual(set(self.found(max_price=Decimal('4999'))), {self.cheap})
+        self.assertEqual(set(self.found(min_year=2020, max_year=2022)), {self.vehicle, self.twin})
+        self.assertEqual(set(self.found(condition='excellent')), {self.twin, self.premium})
+        self.assertEqual(self.found(condition='excellent', max_price=Decimal('5000'), min_year=2021), [self.twin])
+
+    def test_sort_orders_break_ties_on_the_id(self):
+        vehicles = [self.vehicle, self.cheap, self.twin, self.premium]
+        self.assertEqual(self.found(sort='price_asc'), sorted(vehicles, key=lambda v: (v.daily_rate, v.pk)))
+        self.assertEqual(self.found(sort='price_desc'),
+                         sorted(vehicles, key=lambda v: (v.daily_rate, v.pk), reverse=True))
+        self.assertEqual(self.found(sort='year_desc'), [self.premium, self.twin, self.vehicle, self.cheap])
+        self.assertEqual(self.found(sort='newest'), sorted(vehicles, key=lambda v: (v.created_at, v.pk), reverse=True))
+        # Relevance needs keywords, so it falls back to the newest first
+        self.assertEqual(self.found(sort='relevance'), self.found(sort='newest'))
+
+    def test_reversed_ranges_are_form_errors(self):
+        data = {'pickup_location': self.location.pk, 'dropoff_location': self.location.pk,
+                'pickup_date': self.start.strftime('%Y-%m-%dT%H:%M'),
+                'dropoff_date': self.end.strftime('%Y-%m-%dT%H:%M')}
+        self.assertTrue(VehicleSearchForm(data).is_valid())
+        for reversed_range, message in [({'min_price': '6000', 'max_price': '5000'}, "Minimum price cannot be above"),
+                                        ({'min_year': '2024', 'max_year': '2020'}, "The year range is reversed."),
+                                        ({'dropoff_date': data['pickup_date']}, "Dropoff date must be after")]:
+            form = VehicleSearchForm({**data, **reversed_range})
+            self.assertFalse(form.is_valid())
+            self.assertIn(message, form.non_field_errors()[0])
+        # Equal bounds are a valid range
+        self.assertTrue(VehicleSearchForm({**data, 'min_price': '5000', 'max_price': '5000'}).is_valid())
+
+    def test_price_cursor_walks_every_vehicle_once(self):
+        cleaned_data = {'pickup_date': self.start, 'dropoff_date': self.end, 'sort': 'price_asc'}
+        page = search.search_page(cleaned_data, per_page=1)
+        seen = list(page)
+        while page.has_next:
+            page = search.search_page(cleaned_data, page.next_cursor, per_page=1)
+            seen += list(page)
+        self.assertEqual(seen, self.found(sort='price_asc'))
+        # And back again from the last page
+        while page.has_previous:
+            page = search.search_page(cleaned_data, page.previous_cursor, per_page=1)
+            seen.pop()
+            self.assertEqual(list(page), seen[-1:])
+
+
+class AvailabilityCalendarTests(FleetTestCase):
+    def setUp(self):
+        self.day = (timezone.localtime() + timedelta(days=3)).date()
+        self.start, self.end = availability.window_bounds(self.day, 3)
+
+    def at(self, hours):
+        return self.start + timedelta(hours=hours)
+
+    def calendar(self, **params):
+        return self.client.get(reverse('availability_calendar'), params)
+
+    def test_bookings_are_clipped_to_the_window(self):
+        self.make_booking(start_date=self.at(-12), end_date=self.at(84), status='confirmed')
+        edge = self.make_vehicle()
+        self.make_booking(vehicle=edge, start_date=self.at(71), end_date=self.at(73), status='confirmed')
+
+        intervals = availability.booked_intervals([self.vehicle.pk, edge.pk], self.start, self.end)
+        self.assertEqual(intervals, {self.vehicle.pk: [(self.start, self.end)], edge.pk: [(self.at(71), self.end)]})
+        self.assertEqual(availability.booked_days(intervals[self.vehicle.pk], self.start, 3), '111')
+        self.assertEqual(availability.booked_days(intervals[edge.pk], self.start, 3), '001')
+
+    def test_booking_ending_at_midnight_leaves_the_next_day_free(self):
+        self.make_booking(start_date=self.at(10), end_date=self.at(24), status='confirmed')
+        self.make_booking(start_date=self.at(48), end_date=self.at(50), status='cancelled')
+        intervals = availability.booked_intervals([self.vehicle.pk], self.start, self.end)[self.vehicle.pk]
+        self.assertEqual(availability.booked_days(intervals, self.start, 3), '100')
+
+    def test_unknown_and_unapproved_vehicles_are_left_out(self):
+        pending = self.make_vehicle(is_approved=False, approval_status='pending')
+        self.make_booking(start_date=self.at(30), end_date=self.at(40), status='confirmed')
+        response = self.calendar(vehicles=f'{self.vehicle.pk},{pending.pk},999999', start=self.day.isoformat(),
+                                 days=3)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.json()['vehicles']), [str(self.vehicle.pk)])
+        self.assertEqual(response.json()['vehicles'][str(self.vehicle.pk)]['booked_days'], '010')
+
+    def test_form_limits(self):
+        response = self.calendar(vehicles=str(self.vehicle.pk), start=self.day.isoformat())
+        self.assertEqual(response.json()['days'], 30)
+        self.assertEqual(len(response.json()['vehicles'][str(self.vehicle.pk)]['booked_days']), 30)
+
+        too_many = ','.join(str(pk) for pk in range(1, AvailabilityCalendarForm.MAX_VEHICLES + 2))
+        for params, field in [({'days': AvailabilityCalendarForm.MAX_DAYS + 1}, 'days'), ({'days': 0}, 'days'),
+                              ({'vehicles': too_many}, 'vehicles'), ({'vehicles': '1,x'}, 'vehicles'),
+                              ({'vehicles': ','}, 'vehicles'), ({'start': 'soon'}, 'start')]:
+            params = {'vehicles': str(self.vehicle.pk), 'start': self.day.isoformat(), **params}
+            response = self.calendar(**params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn(field, response.json()['errors'])
+
+
+class CursorPaginatorTests(FleetTestCase):
+    def setUp(self):
+        for rate in (3000, 4000, 6000, 7000):
+            self.make_vehicle(daily_rate=Decimal(rate))
+        self.vehicles = Vehicle.objects.all()
+        self.newest = list(self.vehicles.order_by('-created_at', '-id'))
+
+    def test_cursors_walk_forward_and_back(self):
+        paginator = CursorPaginator(self.vehicles, 2)
+        first = paginator.page()
+        second = paginator.page(first.next_cursor)
+        third = paginator.page(second.next_cursor)
+        self.assertEqual(list(first) + list(second) + list(third), self.newest)
+        self.assertFalse(third.has_next)
+        self.assertEqual(list(paginator.page(third.previous_cursor)), self.newest[2:4])
+        self.assertFalse(first.has_previous)
+
+    def test_tampered_cursor_gives_the_first_page(self):
+        paginator = CursorPaginator(self.vehicles, 2)
+        forged = base64.urlsafe_b64encode(json.dumps({'d': 'n', 'v': ['garbage', 'x']}).encode()).decode()
+        for cursor in (forged, 'not a cursor', forged[:-3]):
+            self.assertEqual(list(paginator.page(cursor)), self.newest[:2])
+
+    def test_cursor_from_another_sort_gives_the_first_page(self):
+        by_price = CursorPaginator(self.vehicles, 2, search.ORDERINGS['price_asc'])
+        cursor = by_price.page().next_cursor
+        self.assertEqual(list(CursorPaginator(self.vehicles, 2).page(cursor)), self.newest[:2])
+
+    def test_booking_pages_are_read_in_index_order(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest("checks SQLite query plans")
+        for bookings in (Booking.objects.all(), Booking.objects.filter(client=self.client_user)):
+            plan = bookings.with_effective_status().order_by('-created_at', '-id')[:11].explain()
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_my_bookings_ignores_a_bad_cursor(self):
+        forged = base64.urlsafe_b64encode(json.dumps({'d': 'n', 'v': ['garbage', 'x']}).encode()).decode()
+        self.client.force_login(self.client_user)
+        self.assertEqual(self.client.get(reverse('my_bookings'), {'cursor': forged}).status_code, 200)
+
+
+class FullTextSearchTests(FleetTestCase):
+    def setUp(self):
+        self.subaru = self.make_vehicle(make='Subaru', model='Forester',
+                                        description='Roof rack, toyota-grade reliability')
+        self.land_cruiser = self.make_vehicle(make='Toyota', model='Land Cruiser', description='Seven seats')
+
+    def matches(self, text, vehicles=None):
+        return list(fulltext.match(vehicles or Vehicle.objects.all(), text).order_by('-rank', '-id')
+                    .values_list('pk', flat=True))
+
+    def test_every_word_matches_as_a_prefix(self):
+        self.assertEqual(set(self.matches('toyo')), {self.vehicle.pk, self.land_cruiser.pk, self.subaru.pk})
+        self.assertEqual(self.matches('toy cruis'), [self.land_cruiser.pk])
+        self.assertEqual(self.matches('forester "roof"'), [self.subaru.pk])
+        self.assertEqual(self.matches('tesla'), [])
+
+    def test_make_and_model_outrank_the_description(self):
+        ranked = self.matches('toyota')
+        self.assertEqual(ranked[-1], self.subaru.pk)
+
+    def test_relevance_cursors_walk_every_match_once(self):
+        start = timezone.now() + timedelta(days=2)
+        vehicles = search.available_vehicles(start, start + timedelta(days=1), q='toyota', sort='relevance')
+        paginator = CursorPaginator(vehicles, 1, search.ORDERINGS['relevance'])
+        page, seen = paginator.page(), []
+        while True:
+            seen += [vehicle.pk for vehicle in page]
+            if not page.has_next:
+                break
+            page = paginator.page(page.next_cursor)
+        self.assertEqual(seen, self.matches('toyota'))
+
+    def test_index_follows_inserts_updates_and_deletes(self):
+        tesla = self.make_vehicle(make='Tesla', model='Model Y')
+        self.assertEqual(self.matches('tesla'), [tesla.pk])
+        Vehicle.objects.filter(pk=tesla.pk).update(make='Nissan')
+        self.assertEqual(self.matches('tesla'), [])
+        self.assertEqual(self.matches('nissan'), [tesla.pk])
+        tesla.delete()
+        self.assertEqual(self.matches('nissan'), [])
+
+    def test_missing_triggers_are_recreated_and_the_index_rebuilt(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest("the triggers are SQLite only")
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TRIGGER carhire_vehicle_fts_au")
+        Vehicle.objects.filter(pk=self.subaru.pk).update(make='Mazda')
+        self.assertEqual(self.matches('mazda'), [])
+
+        self.assertEqual(fulltext.ensure_sync(), ['carhire_vehicle_fts_au'])
+        self.assertEqual(self.matches('mazda'), [self.subaru.pk])
+        self.assertEqual(fulltext.ensure_sync(), [])
+
+
+class VehicleTableRebuildTests(TransactionTestCase):
+    def test_migrate_restores_triggers_dropped_by_a_table_rebuild(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest("only SQLite rebuilds tables to alter them")
+        old = Vehicle._meta.get_field('mileage')
+        new = copy.deepcopy(old)
+        new.null = True
+        with connection.schema_editor() as editor:
+            editor.alter_field(Vehicle, old, new)
+        self.addCleanup(self.restore_mileage, old, new)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'carhire_vehicle'")
+            self.assertEqual(cursor.fetchone(), (0,))
+
+        with self.assertLogs('carhire.signals', 'WARNING'):
+            call_command('migrate', verbosity=0)
+        self.assertEqual(fulltext.ensure_sync(), [])
+
+    def restore_mileage(self, old, new):
+        with connection.schema_editor() as editor:
+            editor.alter_field(Vehicle, new, old)
+        fulltext.ensure_sync()
+
+
+class SearchCacheTests(FleetTestCase):
+    def setUp(self):
+        self.day = occupancy._floor_hour(timezone.now()) + timedelta(days=2)
+        # Held 09:00-10:30, which occupies the dates without delisting the vehicle
+        booking = self.make_booking(start_date=self.day + timedelta(hours=9),
+                                    end_date=self.day + timedelta(hours=10, minutes=30))
+        booking.hold()
+        booking.save()
+        metrics.reset()
+
+    def search(self, start_hours, end_hours):
+        return [vehicle.pk for vehicle in search.search_page({
+            'pickup_date': self.day + timedelta(hours=start_hours),
+            'dropoff_date': self.day + timedelta(hours=end_hours), 'sort': 'newest',
+        })]
+
+    def test_search_uses_the_exact_dates(self):
+        self.assertEqual(self.search(10.75, 12), [self.vehicle.pk])
+        self.assertEqual(self.search(10.25, 12), [])
+
+    def test_per_process_cache_is_bypassed(self):
+        self.search(11, 12)
+        self.search(11, 12)
+        self.assertEqual(metrics.snapshot(), {})
+
+    def test_shared_cache_hits_until_a_booking_is_saved(self):
+        with self.settings(CACHES=shared_cache_settings(self)):
+            self.assertEqual(self.search(11, 12), [self.vehicle.pk])
+            self.assertEqual(self.search(11, 12), [self.vehicle.pk])
+            self.assertEqual((metrics.snapshot()['search_cache.misses'], metrics.snapshot()['search_cache.hits']),
+                             (1, 1))
+
+            booking = self.make_booking(start_date=self.day + timedelta(hours=11),
+                                        end_date=self.day + timedelta(hours=12))
+            booking.hold()
+            booking.save()
+            self.assertEqual(self.search(11, 12), [])
+            self.assertEqual(metrics.snapshot()['search_cache.misses'], 2)
+
+
+class SearchApiTests(FleetTestCase):
+    def setUp(self):
+        self.other = self.make_vehicle(make='Subaru', model='Forester', daily_rate=Decimal('4000'))
+        start = timezone.now() + timedelta(days=2)
+        self.params = {'pickup_location': self.location.pk, 'dropoff_location': self.location.pk,
+                       'pickup_date': start.isoformat(), 'dropoff_date': (start + timedelta(days=2)).isoformat(),
+                       'sort': 'price_asc'}
+
+    def get(self, **params):
+        return self.client.get(reverse('search_api'), {**self.params, **params})
+
+    def results(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        return json.loads(b''.join(response.streaming_content))['results']
+
+    def test_streams_the_default_fields_as_json(self):
+        results = self.results(self.get())
+        self.assertEqual([row['id'] for row in results], [self.other.pk, self.vehicle.pk])
+        self.assertEqual(set(results[0]), set(views.SEARCH_API_FIELDS))
+        self.assertEqual(Decimal(results[0]['daily_rate']), Decimal('4000'))
+
+    def test_selects_the_requested_fields(self):
+        self.assertEqual(self.results(self.get(fields='make, model')),
+                         [{'make': 'Subaru', 'model': 'Forester'}, {'make': 'Toyota', 'model': 'Prado'}])
+
+    def test_empty_or_unknown_fields_are_rejected(self):
+        for fields in ('', ',', ' ', 'make,owner', 'admin_notes'):
+            response = self.get(fields=fields)
+            self.assertEqual(response.status_code, 400, fields)
+            self.assertIn('fields', response.json()['errors'])
+
+    def test_form_errors_are_returned_as_json(self):
+        response = self.get(dropoff_date=self.params['pickup_date'])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors']['__all__'], ["Dropoff date must be after pickup date."])
+
+
+class BookingHoldTests(FleetTestCase):
+    def held(self, minutes, **fields):
+        booking = self.make_booking(**fields)
+        booking.hold(minutes)
+        booking.save()
+        return booking
+
+    def overlapping_booking(self, booking):
+        return Booking(client=self.client_user, vehicle=self.vehicle, pickup_location=self.location,
+                       dropoff_location=self.location, start_date=booking.start_date + timedelta(days=1),
+                       end_date=booking.end_date + timedelta(days=1), drive_type='chauffeur')
+
+    def test_held_booking_blocks_its_dates(self):
+        booking = self.held(15)
+        self.assertTrue(booking.occupies())
+        self.assertFalse(self.vehicle.is_available_for_dates(booking.start_date, booking.end_date))
+        with self.assertRaises(ReservationConflict):
+            reserve(self.overlapping_booking(booking))
+
+    def test_lapsed_hold_frees_its_dates_before_the_sweep(self):
+        booking = self.held(15)
+        Booking.objects.filter(pk=booking.pk).update(hold_expires_at=timezone.now() - timedelta(seconds=1))
+        booking.refresh_from_db()
+        self.assertFalse(booking.occupies())
+        self.assertTrue(self.vehicle.is_available_for_dates(booking.start_date, booking.end_date))
+        reserve(self.overlapping_booking(booking))
+
+    def test_sweep_cancels_only_lapsed_holds_and_drops_caches(self):
+        lapsed = [self.held(15, days_from_now=i * 5) for i in range(3)]
+        current = self.held(15, days_from_now=20)
+        Booking.objects.filter(pk__in=[booking.pk for booking in lapsed]).update(
+            hold_expires_at=timezone.now() - timedelta(minutes=1))
+        with self.settings(CACHES=shared_cache_settings(self)), \
+                mock.patch.object(occupancy, 'invalidate') as invalidate_index:
+            version = search.version()
+            self.assertEqual(expire_holds(), 3)
+            self.assertEqual(search.version(), version + 1)
+            invalidate_index.assert_called_once_with()
+
+            self.assertEqual(expire_holds(), 0)
+            self.assertEqual(search.version(), version + 1)
+            self.assertEqual(metrics.snapshot()['holds.expired'], 3)
+        self.assertEqual(Booking.objects.filter(status='cancelled').count(), 3)
+        current.refresh_from_db()
+        self.assertEqual(current.status, 'held')
+
+
+class AvailabilityModeTests(FleetTestCase):
+    def setUp(self):
+        self.current = self.make_vehicle()
+        self.future = self.make_vehicle()
+        self.past = self.make_vehicle()
+        self.held = self.make_vehicle()
+        self.pending = self.make_vehicle(is_approved=False, approval_status='pending')
+        # Written without signals, so the stored flags start out wrong
+        now = timezone.now()
+        bookings = [
+            Booking(client=self.client_user, vehicle=vehicle, pickup_location=self.location,
+                    dropoff_location=self.location, start_date=now + timedelta(days=start),
+                    end_date=now + timedelta(days=start + 2), drive_type='self', status=status,
+                    hold_expires_at=now + timedelta(minutes=15) if status == 'held' else None)
+            for vehicle, start, status in [(self.current, -1, 'active'), (self.future, 3, 'confirmed'),
+                                           (self.past, -5, 'completed'), (self.held, 1, 'held'),
+                                           (self.pending, 1, 'confirmed')]
+        ]
+        for booking in bookings:
+            booking.calculate_costs()
+        Booking.objects.bulk_create(bookings)
+        Vehicle.objects.filter(pk=self.past.pk).update(is_available=False)
+
+    def listed(self, mode):
+        with self.settings(AVAILABILITY_MODE=mode):
+            return set(Vehicle.objects.listed().values_list('pk', flat=True))
+
+    def test_both_modes_list_the_same_vehicles_after_a_refresh(self):
+        computed = self.listed('computed')
+        self.assertEqual(computed, {self.vehicle.pk, self.past.pk, self.held.pk})
+        self.assertNotEqual(self.listed('materialized'), computed)
+        Vehicle.objects.refresh_availability()
+        self.assertEqual(self.listed('materialized'), computed)
+
+    @override_settings(AVAILABILITY_MODE='computed')
+    def test_computed_mode_skips_availability_writes(self):
+        booking = Booking.objects.get(vehicle=self.held)
+        booking.status = 'confirmed'
+        # Only the UPDATE of the booking
+        with self.assertNumQueries(1):
+            booking.save()
+        reserve(Booking(client=self.client_user, vehicle=self.vehicle, pickup_location=self.location,
+                        dropoff_location=self.location, start_date=timezone.now() + timedelta(days=8),
+                        end_date=timezone.now() + timedelta(days=9), drive_type='self', status='confirmed'))
+        self.assertEqual(set(Vehicle.objects.filter(pk__in=[self.vehicle.pk, self.held.pk], is_available=True)
+                             .values_list('pk', flat=True)), {self.vehicle.pk, self.held.pk})
+        self.assertEqual(self.listed('computed'), {self.past.pk})
+
+
+class MyBookingsTests(FleetTestCase):
+    def setUp(self):
+        self.client.force_login(self.client_user)
+        self.overdue = self.make_booking(days_from_now=-5, days=2, status='active')
+        self.lapsed = self.make_booking(days_from_now=4, status='held',
+                                        hold_expires_at=timezone.now() - timedelta(minutes=1))
+        self.upcoming = self.make_booking(days_from_now=10, status='confirmed')
+
+    def statuses(self, response):
+        return {booking.pk: booking.effective_status for booking in response.context['page_obj']}
+
+    def test_stale_statuses_are_shown_as_maintenance_will_persist_them(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('my_bookings'))
+        self.assertEqual(self.statuses(response), {self.overdue.pk: 'completed', self.lapsed.pk: 'cancelled',
+                                                   self.upcoming.pk: 'confirmed'})
+        self.assertContains(response, 'Completed')
+        self.assertContains(response, 'Cancelled')
+        # Derived on read, never written
+        self.assertFalse([query for query in queries if not query['sql'].startswith('SELECT')])
+        self.assertEqual(sorted(Booking.objects.values_list('status', flat=True)), ['active', 'confirmed', 'held'])
+
+    def test_query_count_does_not_grow_with_the_page(self):
+        for _ in range(5):
+            self.make_booking(days_from_now=-5, days=2, status='active', vehicle=self.make_vehicle())
+        # Session, user, then one query for the page with its related rows
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('my_bookings'))
+        self.assertEqual(len(self.statuses(response)), 8)
+
+
+class AvailabilityWatermarkTests(FleetTestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.idle = self.make_vehicle()
+        # Stored flags that disagree with the bookings, which only a full rebuild corrects
+        Vehicle.objects.update(is_available=False)
+
+    def test_missing_watermark_rebuilds_the_whole_fleet(self):
+        self.assertIsNone(maintenance.last_run())
+        self.assertEqual(maintenance.run(self.now), (0, 2, None))
+        self.assertEqual(maintenance.last_run(), self.now)
+        self.assertEqual(Vehicle.objects.filter(is_available=True).count(), 2)
+
+    def test_later_runs_only_touch_vehicles_with_a_boundary_since(self):
+        maintenance.run(self.now)
+        booking = self.make_booking(days_from_now=-3, days=2, status='active')
+        Vehicle.objects.filter(pk=self.idle.pk).update(is_available=False)
+        later = self.now + timedelta(hours=1)
+
+        completed, refreshed, since = maintenance.run(later)
+        # The booking ended before the last run, so it is left for a full rebuild
+        self.assertEqual((completed, refreshed, since), (0, 0, self.now))
+
+        Booking.objects.filter(pk=booking.pk).update(end_date=later + timedelta(minutes=30))
+        self.assertEqual(maintenance.run(later + timedelta(hours=1)), (1, 1, later))
+        self.assertEqual(Booking.objects.get(pk=booking.pk).status, 'completed')
+        self.assertEqual(maintenance.last_run(), later + timedelta(hours=1))
+        self.idle.refresh_from_db()
+        self.assertFalse(self.idle.is_available)
+
+    def test_watermark_created_by_a_concurrent_first_run_is_not_an_error(self):
+        with mock.patch.object(Watermark.objects, 'create', side_effect=IntegrityError('duplicate name')):
+            self.assertEqual(maintenance.run(self.now), (0, 2, None))
+        # The run's own writes survive the failed insert
+        self.assertEqual(Vehicle.objects.filter(is_available=True).count(), 2)
+        Watermark.objects.create(name=maintenance.WATERMARK, value=self.now - timedelta(minutes=1))
+        maintenance.advance(self.now)
+        self.assertEqual(maintenance.last_run(), self.now)
+
+
+class BulkBookingTests(FleetTestCase):
+    def setUp(self):
+        self.other = self.make_vehicle(daily_rate=Decimal('7000'))
+        self.client.force_login(self.client_user)
+        self.start = timezone.now() + timedelta(days=2)
+
+    def book(self, payload=None, **fields):
+        if payload is None:
+            payload = {'vehicles': [self.vehicle.pk, self.other.pk], 'pickup_location': self.location.pk,
+                       'dropoff_location': self.location.pk, 'start_date': self.start.isoformat(),
+                       'end_date': (self.start + timedelta(days=2)).isoformat(), 'drive_type': 'chauffeur',
+                       **fields}
+        return self.client.post(reverse('bulk_book_vehicles'), json.dumps(payload), content_type='application/json')
+
+    @override_settings(BOOKING_HOLD_MINUTES=15, BULK_BOOKING_HOLD_MINUTES=120)
+    def test_vehicles_are_held_for_the_bulk_payment_window(self):
+        response = self.book()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Decimal(response.json()['total_cost']), Decimal('28000'))
+        self.assertEqual(sorted(Booking.objects.values_list('vehicle_id', 'status')),
+                         [(self.vehicle.pk, 'held'), (self.other.pk, 'held')])
+        for expires in Booking.objects.values_list('hold_expires_at', flat=True):
+            self.assertGreater(expires, timezone.now() + timedelta(minutes=115))
+
+    def test_taken_vehicle_rejects_the_whole_order(self):
+        self.make_booking(start_date=self.start, end_date=self.start + timedelta(days=1), vehicle=self.other,
+                          status='confirmed')
+        response = self.book()
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['vehicle_ids'], [self.other.pk])
+        self.assertEqual(Booking.objects.count(), 1)
+
+    def test_only_clients_can_book(self):
+        self.client.force_login(self.owner)
+        self.assertEqual(self.book().status_code, 403)
+        self.assertFalse(Booking.objects.exists())
+
+    def test_self_drive_needs_two_years_of_experience(self):
+        DrivingLicense.objects.create(user=self.client_user, license_number='DL1', expiry_date=date(2030, 1, 1),
+                                      license_image='licenses/dl1.jpg', verification_status='verified')
+        User.objects.filter(pk=self.client_user.pk).update(years_of_experience=1)
+        self.assertEqual(self.book(drive_type='self').status_code, 403)
+        User.objects.filter(pk=self.client_user.pk).update(years_of_experience=5)
+        self.assertEqual(self.book(drive_type='self').status_code, 201)
+
+    def test_body_must_be_a_json_object(self):
+        for payload in ([1, 2], 'vehicles', 7):
+            self.assertEqual(self.book(payload).status_code, 400)
+
+
+class ReservationStressTests(TransactionTestCase):
+    ATTEMPTS = 300
+    WORKERS = 24
+
+    def setUp(self):
+        owner = User.objects.create(username='owner', user_type='owner')
+        self.client_user = User.objects.create(username='client', user_type='client')
+        self.location = Location.objects.create(name='Airport', city='Nairobi')
+        self.vehicles = [
+            Vehicle.objects.create(owner=owner, make='Toyota', model=f'Prado {i}', year=2020, category='suv',
+                                   condition='good', mileage=1000, daily_rate=Decimal('5000'),
+                                   is_approved=True, approval_status='approved')
+            for i in range(3)
+        ]
+        self.origin = timezone.now() + timedelta(days=1)
+
+    def attempt(self, seed, start_signal):
+        rng = random.Random(seed)
+        start = self.origin + timedelta(hours=rng.randint(0, 72))
+        booking = Booking(client=self.client_user, vehicle=rng.choice(self.vehicles),
+                          pickup_location=self.location, dropoff_location=self.location,
+                          start_date=start, end_date=start + timedelta(hours=rng.randint(24, 96)),
+                          drive_type='self', status='confirmed')
+        try:
+            start_signal.wait()
+            reserve(booking)
+            return True
+        except (ReservationConflict, ReservationBusy):
+            return False
+        finally:
+            connection.close()
+
+    def test_concurrent_overlapping_reservations_never_double_book(self):
+        start_signal = threading.Event()
+        with ThreadPoolExecutor(max_workers=self.WORKERS) as pool:
+            futures = [pool.submit(self.attempt, seed, start_signal) for seed in range(self.ATTEMPTS)]
+            start_signal.set()
+            results = [future.result() for future in futures]
+
+        self.assertTrue(any(results))
+        self.assertEqual(Booking.objects.count(), sum(results))
+        for vehicle in self.vehicles:
+            periods = sorted(vehicle.bookings.occupying().values_list('start_date', 'end_date'))
+            for (_, previous_end), (next_start, _) in zip(periods, periods[1:]):
+                self.assertLessEqual(previous_end, next_start)
+
+    def test_lock_failure_is_retried_then_reported_as_busy(self):
+        start = self.origin
+        booking = Booking(client=self.client_user, vehicle=self.vehicles[0], pickup_location=self.location,
+                          dropoff_location=self.location, start_date=start, end_date=start + timedelta(days=2),
+                          drive_type='self')
+        locked = OperationalError('database is locked')
+        with mock.patch.object(reservations, 'lock_vehicles', side_effect=[locked, None]):
+            reserve(booking)
+        self.assertEqual(Booking.objects.count(), 1)
+
+        booking.pk = None
+        with override_settings(RESERVATION_LOCK_RETRIES=1), \
+                mock.patch.object(reservations, 'lock_vehicles', side_effect=locked) as lock_vehicles, \
+                self.assertRaises(ReservationBusy):
+            reserve(booking)
+        self.assertEqual(lock_vehicles.call_count, 2)
+        self.assertEqual(Booking.objects.count(), 1)
+
+
+class ShardedMaintenanceTests(TransactionTestCase):
+    def setUp(self):
+        seed_fleet(40, bookings_per_vehicle=6)
+        self.now = timezone.now()
+        ended = Booking.objects.filter(end_date__lt=self.now).values_list('pk', flat=True)
+        Booking.objects.filter(pk__in=list(ended[:40])).update(status='active')
+        for i in range(6):
+            user = User.objects.create(username=f'driver-{i}')
+            DrivingLicense.objects.create(user=user, license_number=f'DL{i}', license_image='licenses/dl.png',
+                                          expiry_date=date(2020, 1, 1) if i % 2 else date(2099, 1, 1),
+                                          verification_status='verified', is_verified=True)
+
+    def state(self):
+        return (
+            list(Booking.objects.order_by('pk').values_list('pk', 'status')),
+            list(Vehicle.objects.order_by('pk').values_list('pk', 'is_available')),
+            list(DrivingLicense.objects.order_by('pk').values_list('pk', 'verification_status', 'is_verified')),
+        )
+
+    def expected_state(self):
+        """The outcome of the maintenance jobs, worked out row by row in Python"""
+        bookings = list(Booking.objects.order_by('pk').values('pk', 'vehicle_id', 'status', 'end_date'))
+        for booking in bookings:
+            if booking['status'] == 'active' and booking['end_date'] <= self.now:
+                booking['status'] = 'completed'
+        busy = {booking['vehicle_id'] for booking in bookings
+                if booking['status'] in Booking.OCCUPYING_STATUSES and booking['end_date'] > self.now}
+        licenses = [
+            (license.pk, 'expired', False)
+            if license.verification_status == 'verified' and license.expiry_date < self.now.date()
+            else (license.pk, license.verification_status, license.is_verified)
+            for license in DrivingLicense.objects.order_by('pk')
+        ]
+        return (
+            [(booking['pk'], booking['status']) for booking in bookings],
+            [(pk, pk not in busy) for pk in Vehicle.objects.order_by('pk').values_list('pk', flat=True)],
+            licenses,
+        )
+
+    def test_inline_shards_match_row_by_row_result(self):
+        initial, expected = self.state(), self.expected_state()
+        # Every job has something to do
+        for before, after in zip(initial, expected):
+            self.assertNotEqual(before, after)
+
+        results = maintenance.run_sharded(self.now, workers=1, shards=7, batch_size=13)
+        self.assertEqual(self.state(), expected)
+        self.assertEqual({result['job'] for result in results}, set(maintenance.JOBS))
+
+    def test_jobs_run_in_dependency_order(self):
+        expected = self.expected_state()
+        results = maintenance.run_sharded(self.now, jobs=list(reversed(maintenance.JOBS)), workers=1, shards=3)
+        self.assertEqual(self.state(), expected)
+        self.assertEqual(list(dict.fromkeys(result['job'] for result in results)), list(maintenance.JOBS))
+
+    def test_worker_processes_match_row_by_row_result(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("worker processes cannot open an in-memory test database")
+        expected = self.expected_state()
+        maintenance.run_sharded(self.now, workers=3, shards=5, batch_size=50)
+        self.assertEqual(self.state(), expected)
+
+
+class PaymentRaceTests(TransactionTestCase):
+    PAYMENTS = 20
+
+    def setUp(self):
+        owner = User.objects.create(username='owner', user_type='owner')
+        self.client_user = User.objects.create(username='client', user_type='client')
+        location = Location.objects.create(name='Airport', city='Nairobi')
+        vehicle = Vehicle.objects.create(owner=owner, make='Toyota', model='Prado', year=2020, category='suv',
+                                         condition='good', mileage=1000, daily_rate=Decimal('5000'),
+                                         is_approved=True, approval_status='approved')
+        origin = timezone.now() + timedelta(days=1)
+        self.payments = []
+        for i in range(self.PAYMENTS):
+            start = origin + timedelta(days=3 * i)
+            booking = Booking(client=self.client_user, vehicle=vehicle, pickup_location=location,
+                              dropoff_location=location, start_date=start, end_date=start + timedelta(days=2),
+                              drive_type='self')
+            booking.hold()
+            booking.save()
+            self.payments.append(Payment.objects.create(booking=booking, amount=booking.total_cost,
+                                                        phone_number='0700000000', status='processing',
+                                                        paystack_reference=f'MOTR_{i}'))
+
+        self.confirmations = []
+        lock = threading.Lock()
+
+        def counted_confirm(booking):
+            with lock:
+                self.confirmations.append(booking.pk)
+            return confirm(booking)
+
+        patcher = mock.patch.object(payments, 'confirm', counted_confirm)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def callback(self, client, payment, start_signal):
+        start_signal.wait()
+        try:
+            return client.get(reverse('payment_callback'), {'booking_id': payment.booking.booking_id,
+                                                            'reference': payment.paystack_reference})
+        finally:
+            connection.close()
+
+    def webhook(self, payment, start_signal):
+        start_signal.wait()
+        try:
+            return webhooks.apply([{'event': 'charge.success',
+                                    'data': {'id': payment.pk, 'reference': payment.paystack_reference}}])
+        finally:
+            connection.close()
+
+    def test_callback_and_webhook_confirm_each_booking_once(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            # Shared-cache SQLite fails concurrent writers at once instead of waiting for the lock
+            self.skipTest("concurrent writers need a file-backed or server database")
+        verified = {'success': True, 'data': {'status': 'success', 'gateway_response': 'Approved'}}
+        start_signal = threading.Event()
+        with mock.patch.object(views.paystack, 'verify_payment', return_value=verified), \
+                ThreadPoolExecutor(max_workers=8) as pool:
+            callbacks, hooks = [], []
+            for payment in self.payments:
+                client = Client()
+                client.force_login(self.client_user)
+                callbacks.append(pool.submit(self.callback, client, payment, start_signal))
+                hooks.append(pool.submit(self.webhook, payment, start_signal))
+            start_signal.set()
+            responses = [future.result() for future in callbacks]
+            for future in hooks:
+                future.result()
+
+        for payment, response in zip(self.payments, responses):
+            self.assertRedirects(response, reverse('booking_receipt', args=[payment.booking.booking_id]),
+                                 fetch_redirect_response=False)
+        self.assertEqual(sorted(self.confirmations), sorted(payment.booking_id for payment in self.payments))
+        self.assertEqual(Payment.objects.filter(status='completed').count(), self.PAYMENTS)
+        self.assertEqual(Booking.objects.filter(status='confirmed').count(), self.PAYMENTS)
+
+    def test_webhook_completing_during_callback_verify_wins_once(self):
+        payment = self.payments[0]
+        event = {'event': 'charge.success', 'data': {'id': 1, 'reference': payment.paystack_reference}}
+
+        def verify_after_webhook(reference):
+            self.assertEqual(webhooks.apply([event]), 1)
+            return {'success': True, 'data': {'status': 'success'}}
+
+        client = Client()
+        client.force_login(self.client_user)
+        with mock.patch.object(views.paystack, 'verify_payment', verify_after_webhook):
+            response = client.get(reverse('payment_callback'), {'booking_id': payment.booking.booking_id,
+                                                                'reference': payment.paystack_reference})
+        self.assertRedirects(response, reverse('booking_receipt', args=[payment.booking.booking_id]),
+                             fetch_redirect_response=False)
+        self.assertEqual(self.confirmations, [payment.booking_id])
+        self.assertEqual(webhooks.apply([event]), 0)
+
+    def test_completed_payment_cannot_fail_or_restart(self):
+        payment = self.payments[0]
+        self.assertTrue(payments.complete(payment.paystack_reference, {}))
+        self.assertFalse(payments.complete(payment.paystack_reference, {}))
+        self.assertFalse(payments.fail(payment.paystack_reference, 'Declined'))
+        self.assertFalse(payments.start(payment, 'MOTR_new', 'code'))
+        payment.refresh_from_db()
+        self.assertEqual((payment.status, payment.paystack_reference), ('completed', 'MOTR_0'))
+        self.assertEqual(self.confirmations, [payment.booking_id])
+
+
+@override_settings(PAYSTACK_WEBHOOK_SECRET='whsec_test')
+class WebhookInboxTests(FleetTestCase):
+    def setUp(self):
+        self.payments = []
+        for i in range(2):
+            booking = self.make_booking(days_from_now=1 + 5 * i)
+            booking.hold()
+            booking.save()
+            self.payments.append(Payment.objects.create(booking=booking, amount=booking.total_cost,
+                                                        phone_number='0700000000', status='processing',
+                                                        paystack_reference=f'MOTR_{i}'))
+
+    def post(self, body):
+        body = body.encode()
+        signature = hmac.new(b'whsec_test', body, hashlib.sha512).hexdigest()
+        return self.client.post(reverse('payment_webhook'), body, content_type='application/json',
+                                HTTP_X_PAYSTACK_SIGNATURE=signature)
+
+    def charge(self, i, name='charge.success'):
+        return json.dumps({'event': name, 'data': {'id': 100 + i, 'reference': f'MOTR_{i}',
+                                                   'gateway_response': 'Declined'}})
+
+    def statuses(self):
+        return [(payment.status, payment.booking.status)
+                for payment in Payment.objects.select_related('booking').order_by('pk')]
+
+    def test_webhook_is_queued_and_applied_in_a_batch(self):
+        self.assertEqual(self.post(self.charge(0)).status_code, 200)
+        self.assertEqual(self.post(self.charge(1, 'charge.failed')).status_code, 200)
+        self.assertEqual(self.statuses(), [('processing', 'held')] * 2)
+
+        with self.assertLogs('carhire.webhooks', 'INFO'):
+            self.assertEqual(webhooks.process_batch(), 2)
+        self.assertEqual(self.statuses(), [('completed', 'confirmed'), ('failed', 'held')])
+        self.assertFalse(webhooks.pending().exists())
+        self.assertEqual(webhooks.process_batch(), 0)
+
+    def test_body_must_be_a_json_object(self):
+        for body in ('not json', '[1, 2]', '"charge.success"', '{"event": "charge.success", "data": [1]}'):
+            self.assertEqual(self.post(body).status_code, 400, body)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_failed_batch_is_applied_one_event_at_a_time(self):
+        webhooks.record(self.charge(0))
+        webhooks.record(self.charge(1))
+        complete = payments.complete
+
+        def complete_except_first(reference, data):
+            if reference == 'MOTR_0':
+                raise RuntimeError("gateway data rejected")
+            return complete(reference, data)
+
+        with mock.patch.object(payments, 'complete', complete_except_first), \
+                self.assertLogs('carhire.webhooks') as logs:
+            self.assertEqual(webhooks.process_batch(), 2)
+        self.assertIn("ERROR:carhire.webhooks:Webhook batch failed, applying its events one at a time",
+                      [line.split('\n')[0] for line in logs.output])
+        self.assertEqual(self.statuses(), [('processing', 'held'), ('completed', 'confirmed')])
+        failed = WebhookEvent.objects.get(reference='MOTR_0')
+        self.assertEqual((failed.attempts, failed.error, failed.processed_at), (1, 'gateway data rejected', None))
+        self.assertEqual(list(webhooks.pending()), [failed])
+
+        with self.assertLogs('carhire.webhooks', 'INFO'):
+            self.assertEqual(webhooks.process_batch(), 1)
+        self.assertEqual(self.statuses()[0], ('completed', 'confirmed'))
+
+    def test_redelivery_is_recorded_once(self):
+        metrics.reset()
+        self.assertTrue(webhooks.record(self.charge(0)))
+        self.assertFalse(webhooks.record(self.charge(0)))
+        self.assertTrue(webhooks.record(self.charge(0, 'charge.failed')))
+        self.assertEqual(WebhookEvent.objects.count(), 2)
+        snapshot = metrics.snapshot()
+        self.assertEqual((snapshot['webhooks.received'], snapshot['webhooks.duplicates']), (2, 1))
+
+    def test_events_without_id_or_reference_are_never_duplicates(self):
+        body = json.dumps({'event': 'transfer.success', 'data': {}})
+        self.assertTrue(webhooks.record(body))
+        self.assertTrue(webhooks.record(body))
+        self.assertEqual(WebhookEvent.objects.count(), 2)
+
+    def test_prune_deletes_old_processed_and_dead_events_in_batches(self):
+        now = timezone.now()
+        for i in range(6):
+            webhooks.record(json.dumps({'event': 'charge.success', 'data': {'id': i, 'reference': f'R{i}'}}))
+        events = list(WebhookEvent.objects.order_by('pk').values_list('pk', flat=True))
+        WebhookEvent.objects.filter(pk__in=events[:3]).update(processed_at=now - timedelta(days=40))
+        WebhookEvent.objects.filter(pk=events[3]).update(processed_at=now - timedelta(days=10))
+        # Still being retried, then out of attempts
+        WebhookEvent.objects.filter(pk=events[4]).update(received_at=now - timedelta(days=40), attempts=1)
+        WebhookEvent.objects.filter(pk=events[5]).update(received_at=now - timedelta(days=40), attempts=2)
+
+        with override_settings(WEBHOOK_RETENTION_DAYS=30, WEBHOOK_MAX_ATTEMPTS=2):
+            self.assertEqual(webhooks.prune(batch_size=2, now=now), 4)
+        self.assertEqual(list(WebhookEvent.objects.order_by('pk').values_list('pk', flat=True)), events[3:5])
+        self.assertEqual(webhooks.prune(days=5, now=now), 1)
+
+    @override_settings(WEBHOOK_MAX_ATTEMPTS=2)
+    def test_event_is_retried_up_to_max_attempts(self):
+        webhooks.record(self.charge(0))
+        with mock.patch.object(payments, 'complete', side_effect=RuntimeError("still broken")), \
+                self.assertLogs('carhire.webhooks'):
+            self.assertEqual(webhooks.process_batch(), 1)
+            self.assertEqual(webhooks.process_batch(), 1)
+            self.assertEqual(webhooks.process_batch(), 0)
+        self.assertEqual(WebhookEvent.objects.get().attempts, 2)
+        self.assertEqual(webhooks.stats()['dead'], 1)
+
+
+class StubPaystackHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests.append(('GET', self.path, self.client_address[1]))
+        status, delay = self.server.responses.pop(0) if self.server.responses else (200, self.server.delay)
+        verdict = self.server.verdicts.get(self.path.rsplit('/', 1)[-1], 'success')
+        if verdict == 'error':
+            status = 500
+        with self.server.lock:
+            self.server.in_flight += 1
+            self.server.peak = max(self.server.peak, self.server.in_flight)
+        time.sleep(delay)
+        with self.server.lock:
+            self.server.in_flight -= 1
+        self.respond(status, {'status': status == 200, 'data': {'status': verdict, 'amount': 500000}})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append(('POST', self.path, self.client_address[1]))
+        status, delay = self.server.responses.pop(0) if self.server.responses else (200, 0)
+        time.sleep(delay)
+        self.respond(status, {'status': status == 200, 'data': {'authorization_url': 'https://pay.example'}})
+
+    def respond(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except ConnectionError:
+            # The client timed out and hung up
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+def stub_paystack(test, **settings):
+    """Serve StubPaystackHandler on localhost for ``test`` and return the server and a client for it"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubPaystackHandler)
+    server.requests, server.responses, server.verdicts = [], [], {}
+    server.delay, server.in_flight, server.peak, server.lock = 0, 0, 0, threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    test.addCleanup(server.server_close)
+    test.addCleanup(server.shutdown)
+
+    overrides = override_settings(PAYSTACK_BASE_URL=f'http://127.0.0.1:{server.server_port}', **settings)
+    overrides.enable()
+    test.addCleanup(overrides.disable)
+    api = PaystackAPI()
+    test.addCleanup(api.session.close)
+    return server, api
+
+
+class PaystackClientTests(SimpleTestCase):
+    def setUp(self):
+        self.server, self.api = stub_paystack(self, PAYSTACK_READ_TIMEOUT=0.3, PAYSTACK_MAX_RETRIES=2,
+                                              PAYSTACK_BACKOFF_FACTOR=0)
+        metrics.reset()
+
+    def test_calls_reuse_one_connection(self):
+        for _ in range(3):
+            self.assertTrue(self.api.verify_payment('MOTR_1')['success'])
+        self.assertEqual(len({port for _, _, port in self.server.requests}), 1)
+        self.assertEqual(metrics.snapshot()['paystack.verify.latency.count'], 3)
+
+    def test_verify_is_retried_after_server_error(self):
+        self.server.responses = [(503, 0), (502, 0)]
+        self.assertTrue(self.api.verify_payment('MOTR_1')['success'])
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(metrics.snapshot()['paystack.verify.retries'], 2)
+
+    def test_verify_gives_up_after_bounded_retries(self):
+        self.server.responses = [(503, 0)] * 5
+        self.assertFalse(self.api.verify_payment('MOTR_1')['success'])
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(metrics.snapshot()['paystack.verify.errors'], 1)
+
+    def test_slow_verify_times_out(self):
+        self.server.responses = [(200, 1)] * 3
+        started = time.perf_counter()
+        self.assertFalse(self.api.verify_payment('MOTR_1')['success'])
+        # Three read timeouts of 0.3s, well short of the stub's delay each time
+        self.assertLess(time.perf_counter() - started, 2)
+        self.assertEqual(metrics.snapshot()['paystack.verify.retries'], 2)
+
+    def test_initialize_is_not_retried(self):
+        self.server.responses = [(503, 0)]
+        result = self.api.initialize_payment('client@example.com', 500000, 'https://example.com/callback')
+        self.assertFalse(result['success'])
+        self.assertEqual([method for method, _, _ in self.server.requests], ['POST'])
+        self.assertNotIn('paystack.initialize.retries', metrics.snapshot())
+
+
+class ReconcilePaymentsTests(FleetTestCase):
+    VERDICTS = ['success', 'success', 'success', 'success', 'failed', 'abandoned', 'ongoing', 'error']
+
+    def setUp(self):
+        self.server, self.api = stub_paystack(self, PAYSTACK_MAX_RETRIES=0)
+        self.server.delay = 0.05
+        self.now = timezone.now()
+        self.payments = []
+        for i, verdict in enumerate(self.VERDICTS):
+            booking = self.make_booking(days_from_now=1 + 3 * i, days=2)
+            payment = Payment.objects.create(booking=booking, amount=booking.total_cost, phone_number='0700000000')
+            payments.start(payment, f'MOTR_{i}', 'code')
+            self.payments.append(payment)
+            self.server.verdicts[f'MOTR_{i}'] = verdict
+        Payment.objects.update(created_at=self.now - timedelta(hours=3), processing_at=self.now - timedelta(hours=2))
+        # Created long ago, but only just sent to the gateway
+        booking = self.make_booking(days_from_now=40, days=2)
+        self.fresh = Payment.objects.create(booking=booking, amount=booking.total_cost, phone_number='0700000000')
+        Payment.objects.filter(pk=self.fresh.pk).update(created_at=self.now - timedelta(hours=3))
+        payments.start(self.fresh, 'MOTR_fresh', 'code')
+
+    def statuses(self):
+        return [(payment.status, payment.booking.status)
+                for payment in Payment.objects.select_related('booking').order_by('pk')]
+
+    def test_stale_payments_are_verified_concurrently_and_settled(self):
+        totals = reconciliation.reconcile(self.now, minutes=30, workers=4, batch_size=3, client=self.api)
+
+        self.assertEqual({key: value for key, value in totals.items() if key != 'seconds'},
+                         {'checked': 8, 'completed': 4, 'failed': 2, 'conflict': 0, 'skipped': 0, 'unresolved': 2})
+        self.assertEqual(self.statuses(), [('completed', 'confirmed')] * 4 + [('failed', 'pending')] * 2
+                         + [('processing', 'pending')] * 3)
+        self.assertEqual(sorted(path for _, path, _ in self.server.requests),
+                         [f'/transaction/verify/MOTR_{i}' for i in range(8)])
+        self.assertGreater(self.server.peak, 1)
+
+    def test_payment_sent_again_is_stale_from_its_new_reference(self):
+        self.assertTrue(payments.start(self.payments[0], 'MOTR_resent', 'code'))
+
+        def stale(now):
+            return set(reconciliation.stale(now).values_list('paystack_reference', flat=True))
+
+        waiting = {f'MOTR_{i}' for i in range(1, 8)}
+        self.assertEqual(stale(self.now), waiting)
+        self.assertEqual(stale(self.now + timedelta(hours=1)), waiting | {'MOTR_resent', 'MOTR_fresh'})
+
+    def test_payment_settled_elsewhere_is_skipped(self):
+        self.assertTrue(payments.fail('MOTR_4', 'Declined'))
+        stale = reconciliation.stale(self.now)
+        self.assertNotIn('MOTR_4', stale.values_list('paystack_reference', flat=True))
+        self.assertEqual(reconciliation.settle('MOTR_4', {'success': True, 'data': {'status': 'failed'}}), 'skipped')
+
+    def test_taken_dates_complete_payment_without_booking(self):
+        taken = self.payments[0].booking
+        self.make_booking(start_date=taken.start_date, end_date=taken.end_date, status='confirmed')
+        totals = reconciliation.reconcile(self.now, workers=2, limit=1, client=self.api)
+        self.assertEqual((totals['checked'], totals['conflict']), (1, 1))
+        self.assertEqual(self.statuses()[0], ('completed', 'pending'))
+
+    def test_locked_vehicle_leaves_payment_processing_for_a_retry(self):
+        result = {'success': True, 'data': {'status': 'success'}}
+        with mock.patch.object(reservations, 'lock_vehicles', side_effect=OperationalError('database is locked')):
+            self.assertEqual(reconciliation.settle('MOTR_0', result), 'unresolved')
+        self.assertEqual(self.statuses()[0], ('processing', 'pending'))
+        self.assertEqual(reconciliation.settle('MOTR_0', result), 'completed')
+        self.assertEqual(self.statuses()[0], ('completed', 'confirmed'))
@@ -7,6 +7,9 @@ urlpatterns = [
     path('', views.home, name='home'),
     path('search/', views.search_vehicles, name='search_vehicles'),
     path('vehicle/<int:vehicle_id>/', views.vehicle_detail, name='vehicle_detail'),
+    path('api/search/', views.search_api, name='search_api'),
+    path('api/bookings/bulk/', views.bulk_book_vehicles, name='bulk_book_vehicles'),
+    path('api/availability/', views.availability_calendar, name='availability_calendar'),
     
     # Authentication
     path('register/', views.register, name='register'),
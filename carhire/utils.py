@@ -1,45 +1,82 @@
-from datetime import timezone
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError
+from urllib3.util.retry import Retry
 import hashlib
 import hmac
 from django.conf import settings
 from decimal import Decimal
 import uuid
 import logging
+import time
+
+from . import metrics
 
 logger = logging.getLogger(__name__)
 
+def build_session(pool_size, max_retries, backoff_factor):
+    """Keep-alive session; only idempotent GETs are retried on 429/5xx and read errors"""
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({'GET'}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
 class PaystackAPI:
     """Paystack API integration class"""
     
     def __init__(self):
         self.secret_key = settings.PAYSTACK_SECRET_KEY
         self.public_key = settings.PAYSTACK_PUBLIC_KEY
-        self.base_url = "https://api.paystack.co"
+        self.base_url = getattr(settings, 'PAYSTACK_BASE_URL', 'https://api.paystack.co')
+        self.timeout = (getattr(settings, 'PAYSTACK_CONNECT_TIMEOUT', 3.05),
+                        getattr(settings, 'PAYSTACK_READ_TIMEOUT', 10))
+        self.session = build_session(
+            pool_size=getattr(settings, 'PAYSTACK_POOL_SIZE', 10),
+            max_retries=getattr(settings, 'PAYSTACK_MAX_RETRIES', 3),
+            backoff_factor=getattr(settings, 'PAYSTACK_BACKOFF_FACTOR', 0.5),
+        )
+        self.session.headers.update({
+            'Authorization': f'Bearer {self.secret_key}',
+            'Content-Type': 'application/json',
+        })
         
-    def _make_request(self, method, endpoint, data=None):
+    def _make_request(self, method, endpoint, data=None, operation='request'):
         """Make HTTP request to Paystack API"""
         url = f"{self.base_url}{endpoint}"
-        headers = {
-            'Authorization': f'Bearer {self.secret_key}',
-            'Content-Type': 'application/json',
-        }
+        started = time.perf_counter()
+        retries = 0
         
         try:
             if method == 'GET':
-                response = requests.get(url, headers=headers, params=data)
+                response = self.session.get(url, params=data, timeout=self.timeout)
             elif method == 'POST':
-                response = requests.post(url, headers=headers, json=data)
+                response = self.session.post(url, json=data, timeout=self.timeout)
             else:
                 raise ValueError(f"Unsupported HTTP method: {method}")
             
+            if response.raw is not None and response.raw.retries is not None:
+                retries = len(response.raw.retries.history)
             response.raise_for_status()
             return response.json()
             
         except requests.exceptions.RequestException as e:
+            if method == 'GET' and e.args and isinstance(e.args[0], MaxRetryError):
+                retries = self.session.get_adapter(url).max_retries.total
+            metrics.incr(f'paystack.{operation}.errors')
             logger.error(f"Paystack API request failed: {str(e)}")
             return {'status': False, 'message': str(e)}
+        finally:
+            metrics.timing(f'paystack.{operation}.latency', (time.perf_counter() - started) * 1000)
+            if retries:
+                metrics.incr(f'paystack.{operation}.retries', retries)
     
     def initialize_payment(self, email, amount, callback_url, metadata=None):
         """Initialize payment transaction"""
@@ -57,7 +94,7 @@ class PaystackAPI:
         if metadata:
             data['metadata'] = metadata
         
-        response = self._make_request('POST', '/transaction/initialize', data)
+        response = self._make_request('POST', '/transaction/initialize', data, operation='initialize')
         
         if response.get('status'):
             return {
@@ -73,7 +110,7 @@ class PaystackAPI:
     
     def verify_payment(self, reference):
         """Verify payment transaction"""
-        response = self._make_request('GET', f'/transaction/verify/{reference}')
+        response = self._make_request('GET', f'/transaction/verify/{reference}', operation='verify')
         
         if response.get('status'):
             return {
@@ -109,45 +146,5 @@ def verify_webhook_signature(payload, signature):
 
 def process_payment_webhook(event_data):
     """Process Paystack webhook event"""
-    from .models import Payment
-    
-    event = event_data.get('event')
-    
-    if event == 'charge.success':
-        data = event_data.get('data', {})
-        reference = data.get('reference')
-        
-        try:
-            payment = Payment.objects.get(paystack_reference=reference)
-            
-            if payment.status != 'completed':
-                payment.status = 'completed'
-                payment.transaction_id = data.get('id')
-                payment.gateway_response = json.dumps(data)
-                payment.completed_at = timezone.now()
-                payment.save()
-                
-                # Update booking status
-                payment.booking.status = 'confirmed'
-                payment.booking.save()
-                
-                logger.info(f"Payment {reference} completed via webhook")
-            
-        except Payment.DoesNotExist:
-            logger.warning(f"Payment with reference {reference} not found")
-    
-    elif event == 'charge.failed':
-        data = event_data.get('data', {})
-        reference = data.get('reference')
-        
-        try:
-            payment = Payment.objects.get(paystack_reference=reference)
-            payment.status = 'failed'
-            payment.failure_reason = data.get('gateway_response', 'Payment failed')
-            payment.gateway_response = json.dumps(data)
-            payment.save()
-            
-            logger.info(f"Payment {reference} failed via webhook")
-            
-        except Payment.DoesNotExist:
-            logger.warning(f"Payment with reference {reference} not found")
+    from .webhooks import apply
+    return apply([event_data])
@@ -2,14 +2,14 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, authenticate
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse, HttpResponse
-from django.core.paginator import Paginator
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db.models import Q, Count, Sum
 from django.utils import timezone
 from django.template.loader import get_template
 from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_GET, require_POST
 import json
 import requests
 from datetime import datetime, timedelta
@@ -25,9 +25,13 @@ from django.utils.encoding import force_bytes
 from .models import User, Vehicle, Booking, Payment, Location, DrivingLicense
 from .forms import (UserRegistrationForm, VehicleForm, VehicleSearchForm, 
                    BookingForm, DrivingLicenseForm, PaymentForm, 
-                   VehicleApprovalForm, LicenseVerificationForm)
+                   VehicleApprovalForm, LicenseVerificationForm,
+                   AvailabilityCalendarForm, BulkBookingForm)
 
 from .utils import paystack
+from .pagination import CursorPaginator
+from . import availability, payments, pricing, search, webhooks
+from .reservations import ReservationBusy, ReservationConflict, reserve, reserve_many
 from django.urls import reverse
 import logging
 logger = logging.getLogger(__name__)
@@ -35,7 +39,7 @@ logger = logging.getLogger(__name__)
 def home(request):
     """Home page with search functionality"""
     search_form = VehicleSearchForm()
-    featured_vehicles = Vehicle.objects.filter(is_approved=True, approval_status='approved', is_available=True)[:6]
+    featured_vehicles = Vehicle.objects.listed()[:6]
     
     context = {
         'search_form': search_form,
@@ -123,6 +127,7 @@ def add_vehicle(request):
             vehicle.owner = request.user
             vehicle.approval_status = 'pending'
             vehicle.save()
+            form.save_m2m()
             messages.success(request, 'Vehicle added successfully! Awaiting admin approval.')
             return redirect('my_vehicles')
     else:
@@ -142,23 +147,17 @@ def my_vehicles(request):
 def search_vehicles(request):
     """Search available vehicles"""
     form = VehicleSearchForm(request.GET or None)
-    vehicles = Vehicle.objects.filter(is_approved=True, approval_status='approved', is_available=True)
+    cursor = request.GET.get('cursor')
     
     if form.is_valid():
         pickup_date = form.cleaned_data['pickup_date']
         dropoff_date = form.cleaned_data['dropoff_date']
-        category = form.cleaned_data.get('category')
         
-        # Filter by availability for the selected dates
-        available_vehicles = []
-        for vehicle in vehicles:
-            if vehicle.is_available_for_dates(pickup_date, dropoff_date):
-                available_vehicles.append(vehicle.id)
-        
-        vehicles = vehicles.filter(id__in=available_vehicles)
-        
-        if category:
-            vehicles = vehicles.filter(category=category)
+        # Availability is computed with one keyset query and cached per page
+        page_obj = search.search_page(form.cleaned_data, cursor, per_page=9)
+        quotes = pricing.quote_many(page_obj, pickup_date, dropoff_date, 'self')
+        for vehicle in page_obj:
+            vehicle.quote = quotes[vehicle.pk]
         
         # Store search parameters in session
         request.session['search_params'] = {
@@ -167,18 +166,83 @@ def search_vehicles(request):
             'pickup_date': pickup_date.isoformat(),
             'dropoff_date': dropoff_date.isoformat(),
         }
-    
-    paginator = Paginator(vehicles, 9)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    else:
+        vehicles = Vehicle.objects.listed()
+        page_obj = CursorPaginator(vehicles, 9, search.ORDERING).page(cursor)
     
     context = {
         'form': form,
         'page_obj': page_obj,
         'vehicles': page_obj,
+        'query': _query_without_cursor(request),
     }
     return render(request, 'carhire/search_vehicles.html', context)
 
+SEARCH_API_FIELDS = ('id', 'make', 'model', 'year', 'category', 'condition', 'mileage',
+                     'daily_rate', 'description', 'created_at')
+
+def _stream_json_results(rows, chunk_size):
+    """Serialize rows into a JSON document one chunk at a time"""
+    encoder = DjangoJSONEncoder()
+    yield '{"results": ['
+    chunk = []
+    first = True
+    for row in rows:
+        chunk.append(encoder.encode(row))
+        if len(chunk) >= chunk_size:
+            yield ('' if first else ',') + ','.join(chunk)
+            chunk = []
+            first = False
+    if chunk:
+        yield ('' if first else ',') + ','.join(chunk)
+    yield ']}'
+
+@require_GET
+def search_api(request):
+    """Search available vehicles, streamed as JSON"""
+    form = VehicleSearchForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+
+    requested = request.GET.get('fields')
+    fields = [name.strip() for name in requested.split(',') if name.strip()] if requested is not None \
+        else SEARCH_API_FIELDS
+    # values() with no fields would select every column
+    if not fields:
+        return JsonResponse({'errors': {'fields': ["Select at least one field."]}}, status=400)
+    unknown = set(fields) - set(SEARCH_API_FIELDS)
+    if unknown:
+        return JsonResponse({'errors': {'fields': [f"Unknown fields: {', '.join(sorted(unknown))}"]}}, status=400)
+
+    vehicles = search.available_vehicles(
+        form.cleaned_data['pickup_date'],
+        form.cleaned_data['dropoff_date'],
+        **search.criteria(form.cleaned_data)
+    )
+    chunk_size = 500
+    rows = vehicles.values(*fields).iterator(chunk_size=chunk_size)
+    return StreamingHttpResponse(_stream_json_results(rows, chunk_size), content_type='application/json')
+
+@require_GET
+def availability_calendar(request):
+    """Booked intervals and per-day bitmaps for several vehicles"""
+    form = AvailabilityCalendarForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+
+    vehicle_ids = Vehicle.objects.approved().filter(
+        id__in=form.cleaned_data['vehicles']
+    ).values_list('id', flat=True)
+    start = form.cleaned_data['start']
+    days = form.cleaned_data['days']
+    vehicles = availability.calendar(list(vehicle_ids), start, days)
+
+    return JsonResponse({
+        'start': start.isoformat(),
+        'days': days,
+        'vehicles': {str(vehicle_id): data for vehicle_id, data in vehicles.items()},
+    })
+
 def vehicle_detail(request, vehicle_id):
     """Vehicle detail page"""
     vehicle = get_object_or_404(Vehicle, id=vehicle_id, is_approved=True, approval_status='approved')
@@ -224,12 +288,17 @@ def book_vehicle(request, vehicle_id):
                     messages.error(request, 'Please upload your driving license first.')
                     return redirect('upload_license')
             
-            # Check vehicle availability
-            if not vehicle.is_available_for_dates(booking.start_date, booking.end_date):
+            # Hold the vehicle while the client pays, checking availability under the vehicle lock
+            booking.hold()
+            try:
+                reserve(booking)
+            except ReservationConflict:
                 messages.error(request, 'Vehicle is not available for the selected dates.')
                 return redirect('vehicle_detail', vehicle_id=vehicle_id)
+            except ReservationBusy:
+                messages.error(request, 'This vehicle is being booked by someone else right now. Please try again.')
+                return redirect('vehicle_detail', vehicle_id=vehicle_id)
             
-            booking.save()
             return redirect('payment', booking_id=booking.booking_id)
     else:
         initial_data = {}
@@ -252,6 +321,68 @@ def book_vehicle(request, vehicle_id):
     }
     return render(request, 'carhire/book_vehicle.html', context)
 
+@login_required
+@require_POST
+def bulk_book_vehicles(request):
+    """Book up to 50 vehicles for one period in a single transaction (JSON API)
+
+    The vehicles are held for BULK_BOOKING_HOLD_MINUTES while the client pays
+    for each booking, longer than a single booking's hold.
+    """
+    if request.user.user_type != 'client':
+        return JsonResponse({'errors': {'__all__': ['Only clients can book vehicles.']}}, status=403)
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'errors': {'__all__': ['Request body must be JSON.']}}, status=400)
+    if not isinstance(payload, dict):
+        return JsonResponse({'errors': {'__all__': ['Request body must be a JSON object.']}}, status=400)
+    if isinstance(payload.get('vehicles'), list):
+        payload['vehicles'] = ','.join(str(vehicle_id) for vehicle_id in payload['vehicles'])
+
+    form = BulkBookingForm(payload)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    data = form.cleaned_data
+
+    # Same self-drive requirements as book_vehicle
+    if data['drive_type'] == 'self':
+        license = DrivingLicense.objects.filter(user=request.user).first()
+        if license is None or license.verification_status != 'verified':
+            return JsonResponse({'errors': {'drive_type': ['Self-drive requires a verified driving license.']}},
+                                status=403)
+        if request.user.years_of_experience and request.user.years_of_experience < 2:
+            return JsonResponse({'errors': {'drive_type': [
+                'Self-drive requires at least 2 years of driving experience.']}}, status=403)
+
+    vehicles = Vehicle.objects.approved().in_bulk(data['vehicles'])
+    missing = sorted(data['vehicles'] - vehicles.keys())
+    if missing:
+        return JsonResponse({'errors': {'vehicles': ['Unknown vehicles.']}, 'vehicle_ids': missing}, status=400)
+
+    bookings = [
+        Booking(client=request.user, vehicle=vehicle, pickup_location=data['pickup_location'],
+                dropoff_location=data['dropoff_location'], start_date=data['start_date'],
+                end_date=data['end_date'], drive_type=data['drive_type'])
+        for vehicle in vehicles.values()
+    ]
+    # Every booking is paid for on its own, so the whole order gets a longer hold
+    for booking in bookings:
+        booking.hold(getattr(settings, 'BULK_BOOKING_HOLD_MINUTES', 120))
+    try:
+        bookings = reserve_many(bookings)
+    except (ReservationConflict, ReservationBusy) as e:
+        return JsonResponse({'errors': {'vehicles': [str(e)]}, 'vehicle_ids': e.vehicle_ids}, status=409)
+
+    return JsonResponse({
+        'bookings': [
+            {'booking_id': str(booking.booking_id), 'vehicle': booking.vehicle_id, 'total_cost': booking.total_cost}
+            for booking in bookings
+        ],
+        'total_cost': sum(booking.total_cost for booking in bookings),
+        'hold_expires_at': bookings[0].hold_expires_at,
+    }, status=201)
+
 @login_required
 def upload_license(request):
     """Upload driving license"""
@@ -293,6 +424,10 @@ def payment(request, booking_id):
     booking = get_object_or_404(Booking, booking_id=booking_id, client=request.user)
     payment = None
 
+    if booking.hold_expires_at and booking.status in ('held', 'cancelled') and not booking.occupies():
+        messages.error(request, 'Your hold on this vehicle has expired. Please book it again.')
+        return redirect('vehicle_detail', vehicle_id=booking.vehicle_id)
+
     if request.method == 'POST':
         form = PaymentForm(request.POST)
         if form.is_valid():
@@ -323,10 +458,9 @@ def payment(request, booking_id):
             )
 
             if result['success']:
-                payment.paystack_reference = result['reference']
-                payment.paystack_access_code = result['data']['access_code']
-                payment.status = 'processing'
-                payment.save()
+                if not payments.start(payment, result['reference'], result['data']['access_code']):
+                    messages.info(request, 'This booking has already been paid.')
+                    return redirect('my_bookings')
                 return redirect(result['data']['authorization_url'])
             else:
                 messages.error(request, f"Payment initialization failed: {result['message']}")
@@ -364,34 +498,32 @@ def payment_callback(request):
             payment_data = result['data']
             
             if payment_data['status'] == 'success':
-                # Payment successful
-                payment.status = 'completed'
-                payment.transaction_id = payment_data.get('id')
-                payment.gateway_response = json.dumps(payment_data)
-                payment.completed_at = timezone.now()
-                payment.save()
-                
-                # Update booking status
-                booking.status = 'confirmed'
-                booking.save()
+                # The webhook may have completed the payment first; either way the booking is settled once
+                try:
+                    payments.complete(reference, payment_data)
+                except ReservationConflict:
+                    pass
+                except ReservationBusy:
+                    # Left processing for the webhook or reconcile_payments to settle
+                    messages.info(request, 'Payment received. Your booking will be confirmed shortly.')
+                    return redirect('my_bookings')
+                booking.refresh_from_db()
+                if booking.status not in ('confirmed', 'active', 'completed'):
+                    logger.error(f"Payment {reference} completed but booking {booking.booking_id} lost its dates")
+                    messages.error(request, 'Payment received, but the vehicle was booked by someone else for these '
+                                            'dates. Our team will contact you about a refund.')
+                    return redirect('my_bookings')
                 
                 messages.success(request, 'Payment successful! Your booking has been confirmed.')
                 return redirect('booking_receipt', booking_id=booking.booking_id)
             else:
                 # Payment failed
-                payment.status = 'failed'
-                payment.failure_reason = payment_data.get('gateway_response', 'Payment failed')
-                payment.gateway_response = json.dumps(payment_data)
-                payment.save()
+                payments.fail(reference, payment_data.get('gateway_response', 'Payment failed'), payment_data)
                 
                 messages.error(request, 'Payment failed. Please try again.')
                 return redirect('payment', booking_id=booking.booking_id)
         else:
-            # Verification failed
-            payment.status = 'failed'
-            payment.failure_reason = result['message']
-            payment.save()
-            
+            # Verification failed; left processing for the webhook or reconcile_payments to settle
             messages.error(request, f'Payment verification failed: {result["message"]}')
             return redirect('payment', booking_id=booking.booking_id)
             
@@ -403,7 +535,7 @@ def payment_callback(request):
 @csrf_exempt
 @require_POST
 def payment_webhook(request):
-    """Paystack webhook handler"""
+    """Paystack webhook handler; the event is queued and applied by process_webhooks"""
     try:
         payload = request.body
         signature = request.headers.get('X-Paystack-Signature', '')
@@ -413,32 +545,11 @@ def payment_webhook(request):
             logger.warning("Invalid webhook signature")
             return HttpResponse(status=400)
         
-        data = json.loads(payload)
-        event = data.get('event')
-        
-        if event == 'charge.success':
-            # Handle successful payment
-            payment_data = data['data']
-            reference = payment_data.get('reference')
-            
-            try:
-                payment = Payment.objects.get(paystack_reference=reference)
-                
-                if payment.status != 'completed':
-                    payment.status = 'completed'
-                    payment.transaction_id = payment_data.get('id')
-                    payment.gateway_response = json.dumps(payment_data)
-                    payment.completed_at = timezone.now()
-                    payment.save()
-                    
-                    # Update booking status
-                    payment.booking.status = 'confirmed'
-                    payment.booking.save()
-                    
-                    logger.info(f"Payment {reference} completed via webhook")
-                
-            except Payment.DoesNotExist:
-                logger.warning(f"Payment with reference {reference} not found")
+        try:
+            webhooks.record(payload)
+        except ValueError:
+            logger.warning("Webhook body is not JSON")
+            return HttpResponse(status=400)
         
         return HttpResponse(status=200)
         
@@ -447,8 +558,6 @@ def payment_webhook(request):
         return HttpResponse(status=500)
             
 
-            
-           
 @login_required
 def booking_receipt(request, booking_id):
     """Booking receipt page"""
@@ -473,6 +582,13 @@ def download_receipt(request, booking_id):
     response['Content-Disposition'] = f'attachment; filename="receipt_{booking.booking_id}.html"'
     return response
 
+def _query_without_cursor(request):
+    """Current query string minus the pagination parameters"""
+    params = request.GET.copy()
+    params.pop('cursor', None)
+    params.pop('page', None)
+    return params.urlencode()
+
 @login_required
 def my_bookings(request):
     """List user's bookings"""
@@ -483,15 +599,15 @@ def my_bookings(request):
     else:
         bookings = Booking.objects.all().order_by('-created_at')
     
-    # Update expired bookings
-    for booking in bookings:
-        booking.update_status_if_expired()
-    
-    paginator = Paginator(bookings, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Overdue and lapsed statuses are derived here and persisted by refresh_availability / expire_holds
+    bookings = bookings.with_effective_status().select_related('vehicle', 'client', 'pickup_location',
+                                                               'dropoff_location')
+    page_obj = CursorPaginator(bookings, 10).page(request.GET.get('cursor'))
     
-    return render(request, 'carhire/my_bookings.html', {'page_obj': page_obj})
+    return render(request, 'carhire/my_bookings.html', {
+        'page_obj': page_obj,
+        'query': _query_without_cursor(request),
+    })
 
 # Admin Views
 @login_required
@@ -0,0 +1,190 @@
+"""Durable inbox for payment gateway webhooks.
+
+``payment_webhook`` only verifies the signature and stores the event, so the
+gateway gets its 200 after a single INSERT however busy the site is. Paystack
+redelivers webhooks; a unique constraint on (event, gateway id, reference)
+turns a redelivery into a rejected insert, counted as a duplicate, and
+``prune()`` removes processed events once they are older than
+WEBHOOK_RETENTION_DAYS.
+``process_batch()``, run by ``manage.py process_webhooks``, drains the inbox
+oldest first, claiming its events with SELECT ... FOR UPDATE SKIP LOCKED so
+several runs can drain it side by side. Events are grouped by payment
+reference, so a burst of redeliveries costs one write per payment, and the
+payments of a batch move through their ``payments`` transitions in one
+transaction. If a batch fails, its events are applied one at a time so a bad
+event keeps its error and is retried alone, up to WEBHOOK_MAX_ATTEMPTS times.
+A booking whose vehicle is locked by another request (ReservationBusy) fails
+its event the same way, leaving the payment processing until the retry.
+"""
+import json
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import metrics, payments
+from .models import Payment, WebhookEvent
+from .reservations import ReservationConflict
+
+logger = logging.getLogger(__name__)
+
+HANDLED_EVENTS = ('charge.success', 'charge.failed')
+
+
+def max_attempts():
+    return getattr(settings, 'WEBHOOK_MAX_ATTEMPTS', 5)
+
+
+def record(payload):
+    """Queue a verified webhook body; returns False if it was already received
+
+    Raises ValueError if the body is not a JSON object. Events without a
+    gateway id or reference cannot be matched to a redelivery and are always
+    queued.
+    """
+    data = json.loads(payload)
+    if not isinstance(data, dict) or not isinstance(data.get('data') or {}, dict):
+        raise ValueError("Webhook body is not a JSON object")
+    body = data.get('data') or {}
+    event = WebhookEvent(
+        event=data.get('event') or '',
+        gateway_id=str(body.get('id') or ''),
+        reference=body.get('reference') or '',
+        payload=payload.decode() if isinstance(payload, bytes) else payload,
+    )
+    try:
+        with transaction.atomic():
+            event.save()
+    except IntegrityError:
+        metrics.incr('webhooks.duplicates')
+        return False
+    metrics.incr('webhooks.received')
+    return True
+
+
+def pending():
+    return WebhookEvent.objects.filter(processed_at__isnull=True, attempts__lt=max_attempts()).order_by(
+        'received_at', 'id')
+
+
+def outcomes(events):
+    """Final event per payment reference; a successful charge outranks any failure"""
+    latest = {}
+    for event in events:
+        name, data = event.get('event'), event.get('data') or {}
+        reference = data.get('reference')
+        if name not in HANDLED_EVENTS or not reference:
+            continue
+        if latest.get(reference, ('',))[0] == 'charge.success' and name != 'charge.success':
+            continue
+        latest[reference] = (name, data)
+    return latest
+
+
+def apply(events):
+    """Apply parsed webhook bodies to their payments and return how many payments changed"""
+    latest = outcomes(events)
+    if not latest:
+        return 0
+
+    known = set(Payment.objects.referenced().filter(paystack_reference__in=latest).values_list(
+        'paystack_reference', flat=True))
+    for reference in set(latest) - known:
+        logger.warning(f"Payment with reference {reference} not found")
+
+    changed = 0
+    with transaction.atomic():
+        # Lock payments in one order in every worker so concurrent batches cannot deadlock
+        for reference in sorted(known):
+            name, data = latest[reference]
+            if name == 'charge.success':
+                try:
+                    applied = payments.complete(reference, data)
+                except ReservationConflict:
+                    applied = True
+                    logger.error(f"Payment {reference} completed but its booking lost its dates")
+                if applied:
+                    logger.info(f"Payment {reference} completed via webhook")
+            else:
+                applied = payments.fail(reference, data.get('gateway_response', 'Payment failed'), data)
+            changed += applied
+    return changed
+
+
+def _apply_events(events):
+    with transaction.atomic():
+        apply([json.loads(event.payload) for event in events])
+        WebhookEvent.objects.filter(pk__in=[event.pk for event in events]).update(
+            processed_at=timezone.now(), attempts=F('attempts') + 1, error='')
+
+
+def process_batch(batch_size=100):
+    """Apply up to ``batch_size`` queued events and return how many were taken from the inbox
+
+    The events stay locked until the batch commits, and concurrent runs skip
+    locked rows, so two runs never apply the same event.
+    """
+    started = time.perf_counter()
+    failures = 0
+    with transaction.atomic():
+        events = list(pending().select_for_update(skip_locked=True)[:batch_size])
+        if not events:
+            return 0
+
+        try:
+            _apply_events(events)
+        except Exception:
+            logger.exception("Webhook batch failed, applying its events one at a time")
+            for event in events:
+                try:
+                    _apply_events([event])
+                except Exception as e:
+                    failures += 1
+                    WebhookEvent.objects.filter(pk=event.pk).update(attempts=F('attempts') + 1, error=str(e))
+
+    metrics.timing('webhooks.batch', (time.perf_counter() - started) * 1000)
+    metrics.incr('webhooks.processed', len(events) - failures)
+    if failures:
+        metrics.incr('webhooks.failed', failures)
+    return len(events)
+
+
+def prune(days=None, batch_size=1000, now=None):
+    """Delete processed and dead events older than the retention period, in batches; returns the number deleted
+
+    Dead events ran out of attempts and are never processed, so their age is
+    taken from when they were received.
+    """
+    days = getattr(settings, 'WEBHOOK_RETENTION_DAYS', 30) if days is None else days
+    cutoff = (now or timezone.now()) - timedelta(days=days)
+    dead = Q(processed_at__isnull=True, attempts__gte=max_attempts(), received_at__lt=cutoff)
+    expired = WebhookEvent.objects.filter(Q(processed_at__lt=cutoff) | dead).values_list('pk', flat=True)
+    deleted = 0
+    while True:
+        batch = list(expired[:batch_size])
+        if not batch:
+            break
+        # No relations or signals, so this is a single DELETE
+        deleted += WebhookEvent.objects.filter(pk__in=batch).delete()[0]
+    metrics.incr('webhooks.pruned', deleted)
+    return deleted
+
+
+def stats(now=None):
+    """Inbox depth, age in seconds of the oldest queued event, and events that ran out of attempts"""
+    now = now or timezone.now()
+    queued = pending()
+    oldest = queued.values_list('received_at', flat=True).first()
+    values = {
+        'depth': queued.count(),
+        'lag': (now - oldest).total_seconds() if oldest else 0.0,
+        'dead': WebhookEvent.objects.filter(processed_at__isnull=True, attempts__gte=max_attempts()).count(),
+    }
+    metrics.gauge('webhooks.depth', values['depth'])
+    metrics.gauge('webhooks.lag_seconds', values['lag'])
+    metrics.gauge('webhooks.dead', values['dead'])
+    return values
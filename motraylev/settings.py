@@ -111,6 +111,12 @@ DATABASES = {
 
 DATABASES["default"] = dj_database_url.parse(config("DATABASE_URL"))
 
+# SQLite tests default to a shared in-memory database, where concurrent
+# writers fail at once instead of waiting and worker processes cannot connect;
+# a file lets the race and worker-process tests run
+if DATABASES["default"]["ENGINE"] == 'django.db.backends.sqlite3':
+    DATABASES["default"].setdefault('TEST', {}).setdefault('NAME', str(BASE_DIR / 'test_db.sqlite3'))
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -177,7 +183,58 @@ PAYSTACK_SECRET_KEY = config('PAYSTACK_SECRET_KEY')
 PAYSTACK_PUBLIC_KEY = config('PAYSTACK_PUBLIC_KEY')
 PAYSTACK_WEBHOOK_SECRET = config('PAYSTACK_WEBHOOK_SECRET')
 PAYSTACK_TEST_MODE = False
-
+PAYSTACK_BASE_URL = config('PAYSTACK_BASE_URL', default='https://api.paystack.co')
+# (connect, read) seconds; verify calls are retried with exponential backoff
+PAYSTACK_CONNECT_TIMEOUT = config('PAYSTACK_CONNECT_TIMEOUT', default=3.05, cast=float)
+PAYSTACK_READ_TIMEOUT = config('PAYSTACK_READ_TIMEOUT', default=10, cast=float)
+PAYSTACK_MAX_RETRIES = config('PAYSTACK_MAX_RETRIES', default=3, cast=int)
+PAYSTACK_BACKOFF_FACTOR = config('PAYSTACK_BACKOFF_FACTOR', default=0.5, cast=float)
+PAYSTACK_POOL_SIZE = config('PAYSTACK_POOL_SIZE', default=10, cast=int)
+# Webhooks are queued by the view and applied by manage.py process_webhooks
+WEBHOOK_MAX_ATTEMPTS = config('WEBHOOK_MAX_ATTEMPTS', default=5, cast=int)
+# Processed events are kept this long to drop redeliveries, then pruned
+# along with events that ran out of attempts as long ago
+WEBHOOK_RETENTION_DAYS = config('WEBHOOK_RETENTION_DAYS', default=30, cast=int)
+
+
+# In-process occupancy index used to answer availability searches; its
+# invalidation needs a cache shared by every worker, so it stays off on the
+# local-memory default
+OCCUPANCY_INDEX_ENABLED = config('OCCUPANCY_INDEX_ENABLED', default=False, cast=bool)
+OCCUPANCY_INDEX_HORIZON_DAYS = config('OCCUPANCY_INDEX_HORIZON_DAYS', default=180, cast=int)
+OCCUPANCY_INDEX_MAX_AGE = config('OCCUPANCY_INDEX_MAX_AGE', default=300, cast=int)
+
+# Search results are only cached when SEARCH_CACHE_ALIAS names a cache shared
+# by every worker (memcached, redis, file); on the local-memory default a write
+# in one worker could not invalidate the others, so searches go to the database
+SEARCH_CACHE_ALIAS = 'default'
+SEARCH_CACHE_TIMEOUT = config('SEARCH_CACHE_TIMEOUT', default=300, cast=int)
+METRICS_CACHE_ALIAS = 'default'
+
+# 'materialized' lists vehicles by the is_available column that booking saves
+# keep up to date; 'computed' derives it from the bookings on every query and
+# skips those writes (compare with `manage.py benchmark_availability`)
+AVAILABILITY_MODE = config('AVAILABILITY_MODE', default='materialized')
+
+# Rate tables for carhire.pricing. Surcharges and discounts are fractions,
+# e.g. {'luxury': '0.20'} or {7: '0.05', 28: '0.15'} (minimum days: discount);
+# seasons are ('MM-DD', 'MM-DD', multiplier) and may wrap the new year
+PRICING_CHAUFFEUR_DAILY_RATE = 1000
+PRICING_CATEGORY_SURCHARGES = {}
+PRICING_LONG_RENTAL_DISCOUNTS = {}
+PRICING_SEASONS = ()
+
+# Minutes a booking blocks its vehicle while the client pays; run
+# `manage.py expire_holds` every minute or so to release abandoned ones
+BOOKING_HOLD_MINUTES = config('BOOKING_HOLD_MINUTES', default=15, cast=int)
+
+# Minutes a bulk order holds its vehicles; each vehicle is paid for
+# separately, so a corporate order needs longer than one booking
+BULK_BOOKING_HOLD_MINUTES = config('BULK_BOOKING_HOLD_MINUTES', default=120, cast=int)
+
+# Times a reservation retries when its vehicle is locked by another request
+# before giving up with ReservationBusy
+RESERVATION_LOCK_RETRIES = config('RESERVATION_LOCK_RETRIES', default=3, cast=int)
 
 # Site URL for callbacks
 SITE_URL = config('SITE_URL', default='http://127.0.0.1:8000')